@@ -1,38 +1,142 @@
+"""Command line entry point, e.g. `python . train` and then `python . diarize HS_D01 --model Model/classifier`.
+
+Each subcommand imports what it needs when it runs, so headless jobs never load Qt and only a model loads sklearn."""
+import argparse
 import sys
-from PyQt5 import QtWidgets
-from software_model.diarizer import Diarizer
-from software_view.view import MainWindow
 
-import software_model.classifier as classy
-"""
-Below are examples highlighting how the software can be used
-"""
+
+DEFAULT_NETWORK_MODEL = "Model/classifier"
+
+
+def default_training_files():
+    files_to_train_on = ['HS_D{0:0=2d}'.format(i) for i in range(1, 38)]
+    del files_to_train_on[files_to_train_on.index('HS_D11')]
+    del files_to_train_on[files_to_train_on.index('HS_D22')]
+    return files_to_train_on
 
 
 def show_gui():
+    from PyQt5 import QtWidgets
+    from software_view.view import MainWindow
+
     app = QtWidgets.QApplication(sys.argv)
     mainWin = MainWindow()
     mainWin.show()
     sys.exit(app.exec_())
 
 
-def train_net():
-    files_to_train_on = ['HS_D{0:0=2d}'.format(i) for i in range(1, 38)]
-    del files_to_train_on[files_to_train_on.index('HS_D11')]
-    del files_to_train_on[files_to_train_on.index('HS_D22')]
+def train_net(files_to_train_on=None, model_directory=DEFAULT_NETWORK_MODEL):
+    import software_model.classifier as classy
+
+    classy.train_classifier(files_to_train_on or default_training_files(), None, model_directory)
+
+
+def cross_validate_net(files_to_validate_on=None, folds=5, workers=None):
+    import software_model.classifier as classy
 
-    classy.train_classifier(files_to_train_on, None)
+    classy.cross_validate(files_to_validate_on or default_training_files(), folds or None, workers=workers)
 
 
 def evaluate_on_a_particular_file():
-    previously_saved_network_model = "Model/ultimate_model_saved_weights.ckpt"
-    dire = Diarizer(previously_saved_network_model)
-    dire.annotate_wav_file("HS_D01")
+    diarize_files(["HS_D01"], DEFAULT_NETWORK_MODEL)
 
 
-if __name__ == '__main__':
-    print("Go to line 38 in the file '__main__.py' and uncomment a subsequent line")
+def diarize_files(wav_files, network_model, output_directory=None, workers=None, incremental=False):
+    from software_model.diarizer import Diarizer
+    from software_model.constants import PREDICTON_FILES_LOCATION, ORIGINAL_SAMP_RATE_S
+
+    dire = Diarizer(network_model)
+    if incremental:
+        for wav_file in wav_files:
+            num_samples = dire.annotate_wav_file_incrementally(wav_file, output_directory or PREDICTON_FILES_LOCATION)
+            print("Annotated {:.1f}s of new audio in {}".format(num_samples / ORIGINAL_SAMP_RATE_S, wav_file))
+        _print_silence_stats(dire)
+        return
+
+    timings = dire.annotate_wav_files(wav_files, output_directory or PREDICTON_FILES_LOCATION, workers=workers)
+    for wav_file, seconds in timings.items():
+        print("Annotated {} in {:.2f}s".format(wav_file, seconds))
+    if workers == 1:
+        _print_silence_stats(dire)
+
 
-    train_net()
-    # show_gui()
-    # evaluate_on_a_particular_file()
+def _print_silence_stats(diarizer):
+    # Files annotated in worker processes are counted there, so only in-process annotation is reported
+    stats = diarizer.get_silence_stats()
+    if stats['chunks'] > 0:
+        print("Skipped {} of {} chunks ({:.1%}) as silent".format(stats['silent_chunks'], stats['chunks'],
+                                                                  stats['silent_chunks'] / stats['chunks']))
+
+
+def score_predictions(predictions_directory=None, reference_directory=None, workers=None):
+    from software_model.diarization_scorer import score_directory
+    from software_model.constants import PREDICTON_FILES_LOCATION, DATA_FILES_LOCATION
+
+    scores = score_directory(predictions_directory or PREDICTON_FILES_LOCATION,
+                             reference_directory or DATA_FILES_LOCATION, workers)
+    total = scores['total']
+    print("Total over {} files: {:.2%} error ({:.1f}s missed, {:.1f}s false alarm, {:.1f}s reference speech)".format(
+        len(scores['files']), total['error_rate'], total['miss'], total['false_alarm'], total['reference']))
+    if scores['unmatched']:
+        print("Not scored, as there is no reference annotation: " + ', '.join(scores['unmatched']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='diarization', description="Speaker diarization of .wav recordings.")
+    parser.add_argument('--profile', action='store_true', help="Print the time spent in each stage of the pipeline")
+    subparsers = parser.add_subparsers(dest='command')
+
+    diarize_parser = subparsers.add_parser('diarize', help="Annotate recordings with who is speaking when")
+    diarize_parser.add_argument('wav_files', nargs='+',
+                                help="Paths to .wav files, or names of recordings in the data directory")
+    diarize_parser.add_argument('--model', default=DEFAULT_NETWORK_MODEL, help="The trained model to annotate with")
+    diarize_parser.add_argument('--output-dir', help="Where to write the _SpkN.csv files")
+    diarize_parser.add_argument('--workers', type=int, help="Files to annotate at once; defaults to every core")
+    diarize_parser.add_argument('--incremental', action='store_true',
+                                help="Only annotate audio appended since the last incremental run")
+
+    train_parser = subparsers.add_parser('train', help="Train and score the classifiers on annotated recordings")
+    train_parser.add_argument('wav_files', nargs='*', help="Recordings to train on; defaults to the HS_Dxx set")
+    train_parser.add_argument('--model', default=DEFAULT_NETWORK_MODEL, help="Where to save the most accurate model")
+
+    cross_validate_parser = subparsers.add_parser('crossvalidate',
+                                                  help="Cross-validate the classifiers over whole recordings")
+    cross_validate_parser.add_argument('wav_files', nargs='*', help="Recordings to use; defaults to the HS_Dxx set")
+    cross_validate_parser.add_argument('--folds', type=int, default=5,
+                                       help="Number of folds; 0 leaves out one recording at a time")
+    cross_validate_parser.add_argument('--workers', type=int, help="Folds to fit at once; defaults to every core")
+
+    score_parser = subparsers.add_parser('score', help="Score predicted segments against the reference annotations")
+    score_parser.add_argument('--predictions-dir', help="Where the predicted _SpkN.csv files are")
+    score_parser.add_argument('--reference-dir', help="Where the reference _SpkN.csv files are")
+    score_parser.add_argument('--workers', type=int, help="Files to score at once; defaults to every core")
+
+    subparsers.add_parser('gui', help="Open the graphical interface")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    if args.profile:
+        from software_model import instrumentation
+        instrumentation.enable()
+
+    if args.command == 'diarize':
+        diarize_files(args.wav_files, args.model, args.output_dir, args.workers, args.incremental)
+    elif args.command == 'train':
+        train_net(args.wav_files, args.model)
+    elif args.command == 'crossvalidate':
+        cross_validate_net(args.wav_files, args.folds, args.workers)
+    elif args.command == 'score':
+        score_predictions(args.predictions_dir, args.reference_dir, args.workers)
+    elif args.command == 'gui':
+        show_gui()
+
+    if args.profile:
+        instrumentation.print_report()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
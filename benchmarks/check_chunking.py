@@ -0,0 +1,67 @@
+"""Checks that ChunkBatch gives the same chunks as NetworkDataPreprocessor.get_chunk, for several hop sizes.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.check_chunking --duration 30
+
+Every chunk of a synthetic recording is compared through get_chunk, ChunkBatch indexing and iteration, get_data and
+get_chunks, with hops equal to and smaller than the chunk size. Exits with 1 if any chunk differs."""
+import argparse
+import sys
+import tempfile
+import numpy as np
+from benchmarks.synthetic_corpus import generate_corpus
+import software_model.network_data_preprocessor as network_data_preprocessor
+from software_model.network_data_preprocessor import NetworkDataPreprocessor
+from software_model.chunk import ChunkBatch
+from software_model.constants import NUM_SAMPS_IN_CHUNK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check ChunkBatch against per-chunk access for several hop sizes.")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of audio in the recording")
+    parser.add_argument('--hops', type=int, nargs='+',
+                        default=[NUM_SAMPS_IN_CHUNK, NUM_SAMPS_IN_CHUNK // 2, NUM_SAMPS_IN_CHUNK // 4, 7],
+                        help="Hop sizes, in downsampled samples, to check")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        wav_files = generate_corpus(corpus_directory, 1, args.duration)
+        preprocessor = NetworkDataPreprocessor(wav_files)
+
+        mismatches = {hop_size: check_hop_size(preprocessor, hop_size) for hop_size in args.hops}
+
+    for hop_size, mismatched in mismatches.items():
+        print("hop {:>5}: {}".format(hop_size, "ok" if not mismatched else
+                                     "chunks {} differ".format(', '.join(str(i) for i in mismatched[:10]))))
+    return 1 if any(mismatches.values()) else 0
+
+
+def check_hop_size(preprocessor, hop_size, file_index=0):
+    """Returns the indices of the chunks a ChunkBatch with the given hop size gets differently from get_chunk."""
+    chunk_batch = ChunkBatch(preprocessor.read_wav_files()[file_index], NUM_SAMPS_IN_CHUNK, hop_size)
+    data = chunk_batch.get_data()
+    middle = len(chunk_batch) // 2
+    sliced = chunk_batch.get_chunks(middle, len(chunk_batch)).get_data()
+
+    # get_chunk reads the hop from the constants
+    default_hop_size = network_data_preprocessor.NUM_SAMPS_IN_HOP
+    network_data_preprocessor.NUM_SAMPS_IN_HOP = hop_size
+    try:
+        mismatched = []
+        for chunk_index, chunk in enumerate(chunk_batch):
+            expected = preprocessor.get_chunk(file_index, chunk_index)
+            expected = np.stack((expected.get_raw0(), expected.get_raw1()), axis=1)
+            same = (np.array_equal(chunk.get_raw0(), expected[:, 0]) and
+                    np.array_equal(chunk.get_raw1(), expected[:, 1]) and
+                    np.array_equal(data[chunk_index], expected) and
+                    (chunk_index < middle or np.array_equal(sliced[chunk_index - middle], expected)))
+            if not same:
+                mismatched.append(chunk_index)
+        return mismatched
+    finally:
+        network_data_preprocessor.NUM_SAMPS_IN_HOP = default_hop_size
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Times each stage of the pipeline on a synthetic corpus and checks the results against a baseline.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run_benchmarks --files 4 --duration 120 --save-baseline
+    python -m benchmarks.run_benchmarks --files 4 --duration 120 --threshold 0.2
+
+Baselines depend on the machine, so none is committed: the first run on a machine should pass --save-baseline, which
+writes benchmarks/baseline.json for later runs to compare against.
+
+Each stage runs twice, each time in a fresh process after preparing its inputs: once timed, and once with tracemalloc
+tracing only the stage itself, so the peak memory reported is what the stage allocated on top of its inputs (numpy
+reports its arrays to tracemalloc). Throughput is reported as seconds of audio processed per second; a stage regresses
+when its throughput falls more than the threshold below the baseline's."""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmarks.synthetic_corpus import generate_corpus
+
+STAGES = ['downsample', 'get_all_chunks_in_file', 'fft_features', 'get_all_annotated_chunks', 'classifier_fit',
+          'classifier_predict', 'write_to_csv']
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the diarization pipeline.")
+    parser.add_argument('--files', type=int, default=4, help="Number of synthetic recordings")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of audio in each recording")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Fractional drop in throughput, relative to the baseline, counted as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        print("Generating {} x {:.0f}s synthetic recordings".format(args.files, args.duration))
+        wav_files = generate_corpus(corpus_directory, args.files, args.duration)
+        audio_seconds = args.files * args.duration
+
+        results = {}
+        for stage in [s for s in STAGES if s in args.stages]:
+            seconds, _ = _run_in_fresh_process(stage, wav_files, corpus_directory, trace_memory=False)
+            _, peak_mb = _run_in_fresh_process(stage, wav_files, corpus_directory, trace_memory=True)
+            results[stage] = {'seconds': seconds, 'audio_seconds_per_second': audio_seconds / seconds,
+                              'peak_mb': peak_mb}
+
+    baseline = _read_baseline(args.baseline)
+    regressions = _report(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'files': args.files, 'duration': args.duration, 'results': results}, baseline_file, indent=2)
+        print("Saved baseline to " + args.baseline)
+
+    return 1 if regressions and not args.save_baseline else 0
+
+
+def _run_in_fresh_process(stage, wav_files, corpus_directory, trace_memory):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_stage, stage, wav_files, corpus_directory, trace_memory).result()
+
+
+def _run_stage(stage, wav_files, corpus_directory, trace_memory):
+    """Prepares the inputs of a stage, then returns the seconds the stage itself took and, if trace_memory, the peak
+    MB it allocated on top of what was already allocated when it started."""
+    from software_model.network_data_preprocessor import NetworkDataPreprocessor, downsample_file
+    from software_model.audio_store import get_downsampled_file
+    from software_model.network_data_preprocessor_for_training import NetworkDataPreprocessorForTraining
+    from software_model.network_data_postprocessor import NetworkDataPostprocessor
+    from software_model.feature_extractor import FeatureExtractor
+    from software_model.classifier import label_y_values
+
+    if stage == 'downsample':
+        start = _start(trace_memory)
+        for wav_file in wav_files:
+            downsample_file(wav_file, get_downsampled_file(wav_file))
+        return _finish(start)
+
+    if stage == 'get_all_chunks_in_file':
+        preprocessor = NetworkDataPreprocessor(wav_files)
+        _open_every_file(preprocessor, len(wav_files))
+        start = _start(trace_memory)
+        for file_index in range(len(wav_files)):
+            preprocessor.get_all_chunks_in_file(file_index)
+        return _finish(start)
+
+    if stage == 'fft_features':
+        preprocessor = NetworkDataPreprocessor(wav_files)
+        feature_extractor = FeatureExtractor()
+        chunk_batches = [preprocessor.get_all_chunks_in_file(file_index) for file_index in range(len(wav_files))]
+        start = _start(trace_memory)
+        for chunk_batch in chunk_batches:
+            feature_extractor.extract(chunk_batch, 0)
+            feature_extractor.extract(chunk_batch, 1)
+        return _finish(start)
+
+    if stage == 'get_all_annotated_chunks':
+        preprocessor = NetworkDataPreprocessorForTraining(wav_files)
+        _open_every_file(preprocessor, len(wav_files))
+        start = _start(trace_memory)
+        preprocessor.get_all_annotated_chunks()
+        return _finish(start)
+
+    if stage in ('classifier_fit', 'classifier_predict'):
+        from sklearn.tree import DecisionTreeClassifier
+        features, labels = NetworkDataPreprocessorForTraining(wav_files).get_all_annotated_features(FeatureExtractor())
+        labels = label_y_values(labels)
+        classifier = DecisionTreeClassifier()
+        start = _start(trace_memory)
+        classifier.fit(features['fft0'], labels)
+        if stage == 'classifier_predict':
+            start = _start(trace_memory)
+            classifier.predict(features['fft0'])
+        return _finish(start)
+
+    if stage == 'write_to_csv':
+        preprocessor = NetworkDataPreprocessor(wav_files)
+        random = np.random.default_rng(0)
+        outputs = [random.random((len(preprocessor.get_all_chunks_in_file(file_index)), 2))
+                   for file_index in range(len(wav_files))]
+        start = _start(trace_memory)
+        for wav_file, network_output in zip(wav_files, outputs):
+            NetworkDataPostprocessor(network_output, wav_file, corpus_directory).write_to_csv()
+        return _finish(start)
+
+    raise ValueError("Unknown stage; Given: " + str(stage))
+
+
+def _open_every_file(preprocessor, num_files):
+    """Opens, and if need be downsamples, every file of a preprocessor, which otherwise happens on first access."""
+    for file_index in range(num_files):
+        preprocessor.get_chunk(file_index, 0)
+
+
+def _start(trace_memory):
+    """Marks the start of a stage; with trace_memory, its allocations are traced from here."""
+    traced_at_start = None
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_at_start = tracemalloc.get_traced_memory()[0]
+    return time.perf_counter(), traced_at_start
+
+
+def _finish(start):
+    start_time, traced_at_start = start
+    seconds = time.perf_counter() - start_time
+    if traced_at_start is None:
+        return seconds, None
+    return seconds, (tracemalloc.get_traced_memory()[1] - traced_at_start) / 1024 ** 2
+
+
+def _read_baseline(baseline_file):
+    try:
+        with open(baseline_file, 'r') as file_being_read:
+            return json.load(file_being_read)['results']
+    except FileNotFoundError:
+        print("No baseline at {}; run with --save-baseline to make one".format(baseline_file))
+        return {}
+
+
+def _report(results, baseline, threshold):
+    regressions = []
+    print("{:<26}{:>12}{:>16}{:>14}{:>12}".format('stage', 'seconds', 'audio s / s', 'peak MB', 'vs base'))
+    for stage, result in results.items():
+        change = ''
+        if stage in baseline:
+            ratio = result['audio_seconds_per_second'] / baseline[stage]['audio_seconds_per_second']
+            change = '{:+.0%}'.format(ratio - 1)
+            if ratio < 1 - threshold:
+                regressions.append(stage)
+                change += ' !'
+        print("{:<26}{:>12.3f}{:>16.1f}{:>14.1f}{:>12}".format(
+            stage, result['seconds'], result['audio_seconds_per_second'], result['peak_mb'], change))
+
+    if regressions:
+        print("Regressed by more than {:.0%}: {}".format(threshold, ', '.join(regressions)))
+    return regressions
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""This module generates synthetic recordings, with matching speaker annotations, to benchmark the pipeline on."""
+import csv
+import os
+import numpy as np
+from scipy.io import wavfile
+from software_model.constants import ORIGINAL_SAMP_RATE_S, NUM_CHANNELS
+
+
+def generate_corpus(directory, num_files, duration_s, seed=0):
+    """Writes num_files stereo recordings of duration_s seconds to directory, each with a _Spk1.csv and _Spk2.csv.
+
+    Returns the paths of the .wav files."""
+    os.makedirs(directory, exist_ok=True)
+    random = np.random.default_rng(seed)
+
+    wav_files = []
+    for file_index in range(num_files):
+        location = os.path.join(directory, 'SYN_D{0:0=2d}'.format(file_index + 1))
+        generate_recording(location, duration_s, random)
+        wav_files.append(location + '.wav')
+    return wav_files
+
+
+def generate_recording(location, duration_s, random):
+    """Writes location.wav with two alternating, sometimes overlapping speakers, plus their annotation csv files."""
+    num_samps = int(duration_s * ORIGINAL_SAMP_RATE_S)
+    audio = random.normal(0, 200, (num_samps, NUM_CHANNELS))
+
+    for speaker_id in range(2):
+        segments = _random_segments(duration_s, random)
+        for start, end, speaking in segments:
+            if speaking:
+                start_samp, end_samp = int(start * ORIGINAL_SAMP_RATE_S), int(end * ORIGINAL_SAMP_RATE_S)
+                voice = _voice(end_samp - start_samp, random)
+                # Each speaker is closer to one of the microphones
+                audio[start_samp:end_samp, speaker_id] += voice
+                audio[start_samp:end_samp, 1 - speaker_id] += 0.3 * voice
+        _write_annotations(location + '_Spk' + str(speaker_id + 1) + '.csv', segments, speaker_id)
+
+    int16_max = np.iinfo(np.dtype('int16')).max
+    audio = np.clip(audio, -int16_max, int16_max).astype(np.int16)
+    wavfile.write(location + '.wav', ORIGINAL_SAMP_RATE_S, audio)
+
+
+def _random_segments(duration_s, random):
+    segments = []
+    start = 0
+    speaking = int(random.integers(0, 2))
+    while start < duration_s:
+        end = min(duration_s, start + random.uniform(0.5, 4))
+        segments.append((round(start, 3), round(end, 3), speaking))
+        start = end
+        speaking = 1 - speaking
+    return segments
+
+
+def _voice(num_samps, random):
+    """A crude voiced sound: a few harmonics of a wandering pitch under a syllable-rate envelope."""
+    t = np.arange(num_samps) / ORIGINAL_SAMP_RATE_S
+    pitch = random.uniform(90, 250) * (1 + 0.05 * np.sin(2 * np.pi * random.uniform(0.5, 2) * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / ORIGINAL_SAMP_RATE_S
+    voice = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 6))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * random.uniform(3, 6) * t)
+    return 4000 * voice * envelope
+
+
+def _write_annotations(csv_file, segments, speaker_id):
+    with open(csv_file, 'w', newline="\n", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(['tmi0', 'tmax', 'text', 'tier'])
+        writer.writerows([start, end, speaking, speaker_id + 1] for start, end, speaking in segments)
@@ -0,0 +1,28 @@
+"""This module is an encapsulator for the AnnotationIndex class."""
+import numpy as np
+
+
+class AnnotationIndex:
+    """The speaking/non-speaking annotation of one speaker in one file, held as sorted segment end times and values.
+
+    Looking up the status at any number of times is a single searchsorted call."""
+
+    def __init__(self, end_times, statuses):
+        self._end_times = end_times
+        self._statuses = statuses
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        """Reads the tmax and text columns of a tmi0,tmax,text,tier annotation csv in one pass."""
+        annotations = np.loadtxt(csv_file, dtype='float32', delimiter=',', skiprows=1, usecols=(1, 2), ndmin=2)
+        return cls(annotations[:, 0], annotations[:, 1].astype(np.int64))
+
+    def get_statuses(self, times_sec):
+        """Returns the status of the segment containing each of the given times."""
+        segment_indices = np.searchsorted(self._end_times, times_sec, side='right')
+
+        # Times after the last annotated segment (e.g. in the padded section) have no speaking
+        statuses = np.zeros(segment_indices.shape, dtype=np.int64)
+        annotated = segment_indices < self._end_times.shape[0]
+        statuses[annotated] = self._statuses[segment_indices[annotated]]
+        return statuses
@@ -0,0 +1,75 @@
+"""This module is an encapsulator for the AudioStore class."""
+import os
+import numpy as np
+from scipy.io import wavfile
+from software_model.constants import DATA_FILES_LOCATION, SAVE_DOWNSAMPLED_FILES, INPUT_SCALING, RESAMPLER
+from software_model.instrumentation import stage
+
+
+def get_recording_location(file_name):
+    """Returns the path of a recording, without its .wav extension.
+
+    A recording is either named by its path to a .wav file, or by its name alone when it is in DATA_FILES_LOCATION."""
+    if file_name.endswith('.wav'):
+        return file_name[:-len('.wav')]
+    return DATA_FILES_LOCATION + file_name
+
+
+def get_downsampled_file(file_name, input_scaling=INPUT_SCALING, resampler=RESAMPLER):
+    """Returns the path of the downsampled copy of a recording; each input scaling and resampler has its own copy."""
+    suffix = '_downsampled'
+    if input_scaling != 'peak':
+        suffix += '_' + input_scaling
+    if resampler != 'decimate':
+        suffix += '_' + resampler
+    return get_recording_location(file_name) + suffix + '.wav'
+
+
+class AudioStore:
+    """Gives indexed access to the downsampled audio of a list of files.
+
+    Files are only opened the first time they are indexed, and are memory mapped so that pages of audio are read from
+    disk only when a chunk touches them."""
+
+    def __init__(self, file_list, downsampler):
+        self._file_list = file_list
+        self._downsampler = downsampler
+        self._audio = [None] * len(file_list)
+
+    def __len__(self):
+        return len(self._file_list)
+
+    def __getitem__(self, file_index):
+        if self._audio[file_index] is None:
+            self._audio[file_index] = self._open(self._file_list[file_index])
+        return self._audio[file_index]
+
+    def __iter__(self):
+        for file_index in range(len(self)):
+            yield self[file_index]
+
+    def get_source_file(self, file_index):
+        """Returns the file the audio is ultimately derived from; the original recording when it is available."""
+        recording_location = get_recording_location(self._file_list[file_index])
+        if os.path.exists(recording_location + '.wav'):
+            return recording_location + '.wav'
+        return get_downsampled_file(self._file_list[file_index])
+
+    def _open(self, file_name):
+        recording_location = get_recording_location(file_name)
+        downsampled_file = get_downsampled_file(file_name)
+
+        if not os.path.exists(downsampled_file):
+            # The file simply hasn't been downsampled yet, so do so.
+            self._downsampler(recording_location + '.wav', downsampled_file)
+
+        with stage('read_wav') as read_stage:
+            if SAVE_DOWNSAMPLED_FILES is False:
+                # The file is about to be removed, so it can't stay mapped
+                audio = np.array(wavfile.read(downsampled_file)[1])
+                os.remove(downsampled_file)
+            else:
+                audio = wavfile.read(downsampled_file, mmap=True)[1]
+            read_stage.add_bytes_read(audio.nbytes)
+
+        return audio
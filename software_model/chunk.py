@@ -1,12 +1,15 @@
+from math import ceil
 import numpy as np
-from scipy.fftpack import fft
+from numpy.lib.stride_tricks import as_strided
+from scipy.fft import rfft
+from software_model.constants import NUM_SAMPS_IN_CHUNK, NUM_SAMPS_IN_HOP
 
 
 class Chunk:
 
     def __init__(self, chunk_data):
         self.__raw0 = np.array(chunk_data[:, 0])
-        self.__raw1 = np.array(chunk_data[:, 0])
+        self.__raw1 = np.array(chunk_data[:, 1])
         self.__fft0 = None  # Use lazy loading
         self.__fft1 = None  # Use lazy loading
 
@@ -29,8 +32,124 @@ class Chunk:
         return self.__fft1
 
     def __get_fft(self, raw):
-            fft_data = np.abs(fft(raw))
-            # Split in half due to the real number symmetry of the fft
-            half_length = fft_data.shape[0]//2
-            fft_data = np.array(fft_data[:half_length+1])
-            return fft_data
+            # The real input fft only computes the non-redundant half of the spectrum
+            return np.abs(rfft(raw))
+
+
+class ChunkBatch:
+    """All the chunks of one audio file, held as a strided view over the audio instead of as Chunk objects.
+
+    Chunks start every hop_size samples, so they overlap when hop_size is less than chunk_size. Only the final chunks,
+    which run past the end of the audio, are copied (and zero padded); every other chunk is a view into the audio."""
+
+    def __init__(self, audio, chunk_size=NUM_SAMPS_IN_CHUNK, hop_size=NUM_SAMPS_IN_HOP, num_chunks=None):
+        self._audio = audio
+        self._chunk_size = chunk_size
+        self._hop_size = hop_size
+        self.num_samps = audio.shape[0]
+        self.num_chunks = ceil(self.num_samps / hop_size)
+        if num_chunks is not None:
+            self.num_chunks = min(self.num_chunks, num_chunks)
+
+        num_full_chunks = 0 if self.num_samps < chunk_size else (self.num_samps - chunk_size) // hop_size + 1
+        num_full_chunks = min(num_full_chunks, self.num_chunks)
+        self._body = self._frame(audio, num_full_chunks)
+
+        num_tail_chunks = self.num_chunks - num_full_chunks
+        if num_tail_chunks > 0:
+            tail = audio[num_full_chunks * hop_size:, :]
+            tail_size = (num_tail_chunks - 1) * hop_size + chunk_size
+            tail = np.pad(tail, ((0, tail_size - tail.shape[0]), (0, 0)), 'constant', constant_values=(0, 0))
+            self._tail = self._frame(tail, num_tail_chunks)
+        else:
+            self._tail = None
+
+        self._features = {}
+
+    def _frame(self, audio, num_chunks):
+        samp_stride, channel_stride = audio.strides
+        return as_strided(audio, shape=(num_chunks, self._chunk_size, audio.shape[1]),
+                          strides=(self._hop_size * samp_stride, samp_stride, channel_stride), writeable=False)
+
+    def __len__(self):
+        return self.num_chunks
+
+    def __getitem__(self, chunk_index):
+        return Chunk(self.get_chunk_data(chunk_index))
+
+    def __iter__(self):
+        for chunk_index in range(self.num_chunks):
+            yield self[chunk_index]
+
+    def get_chunk_data(self, chunk_index):
+        """Returns the (NUM_SAMPS_IN_CHUNK, NUM_CHANNELS) samples of a single chunk."""
+        if chunk_index < 0:
+            chunk_index += self.num_chunks
+        if not 0 <= chunk_index < self.num_chunks:
+            raise IndexError("Chunk index out of range; Given: " + str(chunk_index))
+
+        if chunk_index < self._body.shape[0]:
+            return self._body[chunk_index]
+        return self._tail[chunk_index - self._body.shape[0]]
+
+    def get_chunks(self, start, stop):
+        """Returns a ChunkBatch of the chunks from start up to, but not including, stop."""
+        stop = min(stop, self.num_chunks)
+        audio = self._audio[start * self._hop_size:(stop - 1) * self._hop_size + self._chunk_size]
+        return self._with_features(ChunkBatch(audio, self._chunk_size, self._hop_size, stop - start),
+                                   slice(start, stop))
+
+    def load(self):
+        """Returns a copy of this batch held in memory, so using it never waits on a memory mapped file."""
+        return self._with_features(ChunkBatch(np.array(self._audio), self._chunk_size, self._hop_size,
+                                              self.num_chunks), slice(None))
+
+    def get_blocks(self):
+        """Returns the 3D arrays which, taken in order, make up every chunk of the file.
+
+        Batched consumers should iterate over these rather than call get_data(), which has to copy."""
+        if self._tail is None:
+            return [self._body]
+        return [self._body, self._tail]
+
+    def get_data(self):
+        """Returns every chunk as a single (num_chunks, NUM_SAMPS_IN_CHUNK, NUM_CHANNELS) array."""
+        blocks = self.get_blocks()
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks, axis=0)
+
+    def take(self, chunk_indices):
+        """Returns a ChunkBatch of only the chunks at the given increasing indices, copied next to one another."""
+        chunk_indices = np.asarray(chunk_indices)
+        num_body_chunks = self._body.shape[0]
+        data = self._body[chunk_indices[chunk_indices < num_body_chunks]]
+        if self._tail is not None:
+            data = np.concatenate((data, self._tail[chunk_indices[chunk_indices >= num_body_chunks] - num_body_chunks]))
+        return self._with_features(ChunkBatch(data.reshape(-1, data.shape[2]), self._chunk_size, self._chunk_size),
+                                   chunk_indices)
+
+    def get_features(self, channel, feature_extractor):
+        """Returns the (num_chunks, num_bins) spectral features of one channel, computing them once per extractor setting."""
+        key = self._get_features_key(channel, feature_extractor)
+        if key not in self._features:
+            self._features[key] = feature_extractor.extract(self, channel)
+        return self._features[key]
+
+    def set_features(self, channel, feature_extractor, features):
+        """Supplies the features of one channel computed elsewhere, e.g. read from a FeatureCache, for get_features.
+
+        Batches made from this one by get_chunks, take or load are given the features of their own chunks."""
+        self._features[self._get_features_key(channel, feature_extractor)] = features
+
+    def _get_features_key(self, channel, feature_extractor):
+        return (channel,) + tuple(sorted(feature_extractor.get_settings().items()))
+
+    def _with_features(self, chunk_batch, rows):
+        for key, features in self._features.items():
+            chunk_batch._features[key] = features[rows]
+        return chunk_batch
+
+    def get_channel(self, channel):
+        """Returns the raw samples of one channel as a (num_chunks, NUM_SAMPS_IN_CHUNK) array."""
+        return self.get_data()[:, :, channel]
@@ -1,6 +1,23 @@
 from software_model.network_data_preprocessor_for_training import NetworkDataPreprocessorForTraining
-import sys
+from software_model.feature_extractor import FeatureExtractor
+from software_model.feature_cache import FeatureCache
+from software_model.constants import USE_FEATURE_CACHE, CLASSIFIER_WORKERS
+from software_model.instrumentation import stage
+from concurrent.futures import ProcessPoolExecutor
+import os
+import random
+import tempfile
+import time
+import numpy as np
 from sklearn.tree import DecisionTreeClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from software_model.training_batch_sampler import TrainingBatchSampler
+from software_model.trained_model import TrainedModel
+
+FEATURE_VIEWS = ['raw0', 'raw1', 'fft0', 'fft1']
+
+
 def label_y_value(y_value):
     if y_value == [0,0]:
         return "A"
@@ -14,74 +31,211 @@ def label_y_value(y_value):
     raise ValueError("Must be of the form [x,y] where x,y in {0,1}; Given: "+str(y_value))
 
 
-def get_accuracy(trained_classifer, test_x, test_y_labels):
-    y_predict_labels = train_classifier.predict(test_x)
+def label_y_values(y_values):
+    """Vectorized label_y_value over a (num_chunks, 2) array of speaker statuses."""
+    y_values = np.asarray(y_values)
+    if not np.isin(y_values, (0, 1)).all():
+        raise ValueError("Must be of the form [x,y] where x,y in {0,1}")
+
+    return np.array(['A', 'B', 'C', 'D'])[2 * y_values[:, 0] + y_values[:, 1]]
+
+
+def get_accuracy(trained_classifier, test_x, test_y_labels):
+    y_predict_labels = trained_classifier.predict(test_x)
+    return np.mean(y_predict_labels == np.asarray(test_y_labels))
+
+
+def fit_classifiers(X_training, y_training_labels, X_testing, y_testing_labels, workers=CLASSIFIER_WORKERS):
+    """Fits and scores a DecisionTreeClassifier on each feature view, each in its own worker process.
+
+    The feature matrices are written once to a temporary directory and memory mapped read-only by every worker,
+    rather than pickled to each of them. Returns a dict mapping each view to its classifier, accuracy and timings."""
+    with tempfile.TemporaryDirectory() as shared_directory:
+        _share_array(shared_directory, 'y_training', np.asarray(y_training_labels))
+        _share_array(shared_directory, 'y_testing', np.asarray(y_testing_labels))
+        for view in FEATURE_VIEWS:
+            _share_array(shared_directory, view + '_training', X_training[view])
+            _share_array(shared_directory, view + '_testing', X_testing[view])
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {view: executor.submit(_fit_and_score, shared_directory, view) for view in FEATURE_VIEWS}
+            return {view: future.result() for view, future in futures.items()}
+
+
+def _share_array(shared_directory, name, array):
+    np.save(os.path.join(shared_directory, name + '.npy'), array)
+
+
+def _load_shared_array(shared_directory, name):
+    return np.load(os.path.join(shared_directory, name + '.npy'), mmap_mode='r')
+
+
+def _fit_and_score(shared_directory, view):
+    return _fit_and_score_arrays(_load_shared_array(shared_directory, view + '_training'),
+                                 _load_shared_array(shared_directory, 'y_training'),
+                                 _load_shared_array(shared_directory, view + '_testing'),
+                                 _load_shared_array(shared_directory, 'y_testing'))
+
+
+def _fit_and_score_arrays(X_training, y_training_labels, X_testing, y_testing_labels):
+    classifier = DecisionTreeClassifier()
+
+    start = time.perf_counter()
+    classifier.fit(X_training, y_training_labels)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    accuracy = get_accuracy(classifier, X_testing, y_testing_labels)
+    predict_seconds = time.perf_counter() - start
+
+    return {'classifier': classifier, 'accuracy': accuracy, 'fit_seconds': fit_seconds,
+            'predict_seconds': predict_seconds}
+
+
+def cross_validate(wav_file_names, folds=5, views=FEATURE_VIEWS, workers=CLASSIFIER_WORKERS, seed=None):
+    """Scores a DecisionTreeClassifier on each feature view by k-fold cross-validation over whole files.
+
+    The files are shuffled and split into folds, or with folds=None each file is its own fold (leave-one-file-out).
+    Every file is featurized once; the feature matrices are then memory mapped read-only by the worker processes,
+    which fit and score each fold of each view in parallel. Returns a dict holding each fold's test files and its
+    accuracy and timings for each view, the mean and sample variance of each view's accuracy, and the seconds spent
+    featurizing."""
+    wav_file_names = list(wav_file_names)
+    if folds is None:
+        folds = len(wav_file_names)
+    if not 2 <= folds <= len(wav_file_names):
+        raise ValueError("Need between 2 and {} folds; Given: {}".format(len(wav_file_names), folds))
+
+    order = list(range(len(wav_file_names)))
+    random.Random(seed).shuffle(order)
+    fold_files = [sorted(fold.tolist()) for fold in np.array_split(order, folds)]
+
+    print("Featurizing {} files".format(len(wav_file_names)))
+    start = time.perf_counter()
+    with stage('read_training_data'):
+        data = NetworkDataPreprocessorForTraining(wav_file_names, FeatureCache() if USE_FEATURE_CACHE else None)
+        X, y_native = data.get_all_annotated_features(FeatureExtractor())
+        file_offsets = data.get_file_offsets()
+    featurize_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as shared_directory:
+        _share_array(shared_directory, 'y', label_y_values(y_native))
+        for view in views:
+            _share_array(shared_directory, view, X[view])
+        del X
 
-    sum = 0;
-    total = 0;
-    for index, y_prediction in enumerate(y_predict_labels):
-        total += 1
-        if y_prediction == test_y_labels[index]:
-            sum += 1
+        print("Cross-validating over {} folds".format(folds))
+        with stage('cross_validate'), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {(fold, view): executor.submit(_fit_and_score_fold, shared_directory, view,
+                                                     [(file_offsets[i], file_offsets[i + 1]) for i in test_files])
+                       for fold, test_files in enumerate(fold_files) for view in views}
+            fold_results = [{view: futures[fold, view].result() for view in views} for fold in range(folds)]
 
-    return sum/total
+    summary = {}
+    for view in views:
+        accuracies = [fold_result[view]['accuracy'] for fold_result in fold_results]
+        summary[view] = {'mean': float(np.mean(accuracies)), 'variance': float(np.var(accuracies, ddof=1))}
 
-def train_classifier(wav_file_names, classifier):
+    for fold, fold_result in enumerate(fold_results):
+        for view in views:
+            print("Fold {} of {}, {}: accuracy {:.4f} (fit {:.2f}s, predict {:.2f}s)".format(
+                fold + 1, folds, view, fold_result[view]['accuracy'], fold_result[view]['fit_seconds'],
+                fold_result[view]['predict_seconds']))
+    for view in views:
+        print("Accuracy of {}: mean {:.4f}, variance {:.6f}".format(view, summary[view]['mean'],
+                                                                     summary[view]['variance']))
 
-    import random as random
+    return {'folds': [{'test_files': [wav_file_names[i] for i in test_files], 'results': fold_result}
+                      for test_files, fold_result in zip(fold_files, fold_results)],
+            'summary': summary, 'featurize_seconds': featurize_seconds}
+
+
+def _fit_and_score_fold(shared_directory, view, test_row_ranges):
+    X = _load_shared_array(shared_directory, view)
+    y = _load_shared_array(shared_directory, 'y')
+
+    is_test = np.zeros(X.shape[0], dtype=bool)
+    for start, stop in test_row_ranges:
+        is_test[start:stop] = True
+
+    result = _fit_and_score_arrays(X[~is_test], y[~is_test], X[is_test], y[is_test])
+    del result['classifier']  # Only the scores are sent back, not every fold's tree
+    return result
+
+
+def train_classifier(wav_file_names, classifier, model_directory=None):
+    """Fits and scores a classifier on each feature view, saving the most accurate to model_directory if given."""
     random.shuffle(wav_file_names)
 
     training_files = wav_file_names[:int(0.8 * len(wav_file_names))]
     testing_files = wav_file_names[int(0.8 * len(wav_file_names)):]
 
+    feature_extractor = FeatureExtractor()
+    feature_cache = FeatureCache() if USE_FEATURE_CACHE else None
+
     print("Reading in training data")
-    train_data = NetworkDataPreprocessorForTraining(training_files)
-    X_training, y_training_native = train_data.get_all_annotated_chunks()
-    y_training_labels = [label_y_value(y_value) for y_value in y_training_native]
+    with stage('read_training_data'):
+        train_data = NetworkDataPreprocessorForTraining(training_files, feature_cache)
+        X_training, y_training_native = train_data.get_all_annotated_features(feature_extractor)
+        y_training_labels = label_y_values(y_training_native)
     
     print("Reading in test data")
-    test_data = NetworkDataPreprocessorForTraining(testing_files)
-    X_testing, y_testing_native = test_data.get_all_annotated_chunks()
-    y_testing_labels = [label_y_value(y_value) for y_value in y_testing_native]
-    
-    
-    X_training_raw0 = []
-    X_training_raw1 = []
-    X_training_fft0 = []
-    X_training_fft1 = []
-    
-    print("Spliting Data")
-    for x in X_training:
-        X_training_raw0.append(x.get_raw0())
-        X_training_raw1.append(x.get_raw1())
-        X_training_fft0.append(x.get_fft0())
-        X_training_fft1.append(x.get_fft1())
-    
-    print("Initializing Classifiers")
-    raw0_classifier = DecisionTreeClassifier()
-    raw1_classifier = DecisionTreeClassifier()
-    fft0_classifier = DecisionTreeClassifier()
-    fft1_classifier = DecisionTreeClassifier()
-    
-    print("Training raw0_classifier")
-    raw0_classifier.fit(X_training_raw0, y_training_labels)
-    print("Training raw1_classifier")
-    raw1_classifier.fit(X_training_raw1, y_training_labels)
-    print("Training fft0_classifier")
-    fft0_classifier.fit(X_training_fft0, y_training_labels)
-    print("Training fft1_classifier")
-    fft1_classifier.fit(X_training_fft1, y_training_labels)
-    
-    print("Getting Accuracy")
-    
-    araw0 = get_accuracy(raw0_classifier, X_testing, y_testing_labels)
-    print("Accuracy of raw0: ", araw0)
+    with stage('read_test_data'):
+        test_data = NetworkDataPreprocessorForTraining(testing_files, feature_cache)
+        X_testing, y_testing_native = test_data.get_all_annotated_features(feature_extractor)
+        y_testing_labels = label_y_values(y_testing_native)
     
-    araw1 = get_accuracy(raw1_classifier, X_testing, y_testing_labels)
-    print("Accuracy of raw1: ", araw1)
-    
-    afft0 = get_accuracy(fft0_classifier, X_testing, y_testing_labels)
-    print("Accuracy of fft0: ", afft0)
-    
-    afft1 = get_accuracy(fft1_classifier, X_testing, y_testing_labels)
-    print("Accuracy of fft1: ", afft1)
\ No newline at end of file
+    print("Training classifiers")
+    with stage('fit_classifiers'):
+        results = fit_classifiers(X_training, y_training_labels, X_testing, y_testing_labels)
+
+    for view in FEATURE_VIEWS:
+        print("Accuracy of {}: {:.4f} (fit {:.2f}s, predict {:.2f}s)".format(
+            view, results[view]['accuracy'], results[view]['fit_seconds'], results[view]['predict_seconds']))
+
+    if model_directory is not None:
+        best_view = max(FEATURE_VIEWS, key=lambda view: results[view]['accuracy'])
+        model = TrainedModel(results[best_view]['classifier'], best_view, feature_extractor.get_settings(),
+                             metadata={'accuracy': float(results[best_view]['accuracy']),
+                                       'training_files': training_files, 'testing_files': testing_files})
+        model.save(model_directory)
+        print("Saved the {} classifier to {}".format(best_view, model_directory))
+
+    return results
+
+
+def train_classifier_out_of_core(training_dataset, testing_dataset, view='fft0', epochs=5, batch_size=4096,
+                                 model_directory=None):
+    """Trains a linear classifier on one feature view of two ShardedDatasets without loading either into memory.
+
+    Features are standardized with statistics gathered a shard at a time, the classifier is fitted a batch at a time
+    from a TrainingBatchSampler, and it is scored a shard at a time. The classifier and scaler are saved to
+    model_directory if given."""
+    classes = np.array(['A', 'B', 'C', 'D'])
+
+    print("Standardizing " + view)
+    scaler = StandardScaler()
+    for features, _ in training_dataset.iter_shards([view]):
+        scaler.partial_fit(features[view])
+
+    sampler = TrainingBatchSampler({view: training_dataset.get_features()[view]}, training_dataset.get_labels(),
+                                   batch_size, training_dataset.file_offsets)
+    sgd_classifier = SGDClassifier()
+    for epoch in range(epochs):
+        print("Training {} classifier, epoch {} of {}".format(view, epoch + 1, epochs))
+        for features, labels in sampler:
+            sgd_classifier.partial_fit(scaler.transform(features[view]), label_y_values(labels), classes=classes)
+
+    num_correct = 0
+    for features, labels in testing_dataset.iter_shards([view]):
+        y_predict_labels = sgd_classifier.predict(scaler.transform(features[view]))
+        num_correct += np.sum(y_predict_labels == label_y_values(labels))
+    accuracy = num_correct / len(testing_dataset)
+    print("Accuracy of {}: {:.4f}".format(view, accuracy))
+
+    if model_directory is not None:
+        model = TrainedModel(sgd_classifier, view, training_dataset.index['settings']['features'], scaler,
+                             metadata={'accuracy': float(accuracy)})
+        model.save(model_directory)
+
+    return {'classifier': sgd_classifier, 'scaler': scaler, 'accuracy': accuracy}
@@ -13,13 +13,67 @@ DOWNSAMPLE_FACTOR = 4
 SAMP_RATE_S = ORIGINAL_SAMP_RATE_S // DOWNSAMPLE_FACTOR  # Vals / s (Hz)
 SAMP_RATE_MS = SAMP_RATE_S / 1000  # vals / ms (kHz)
 SAVE_DOWNSAMPLED_FILES = True
+# 'none' keeps recordings at their recorded int16 level, so files and streams give the model the same audio; 'peak'
+# normalizes each file by its peak, which a stream can't know in advance, so streams require 'none'
+INPUT_SCALING = 'none'
+RESAMPLER = 'decimate'  # 'decimate' (IIR, as scipy.signal.decimate) or 'polyphase' (FIR, as scipy.signal.resample_poly)
+DOWNSAMPLE_WORKERS = None  # Processes used for bulk downsampling; None uses every core
+STREAMING_DOWNSAMPLE_MIN_BYTES = 256 * 1024 ** 2  # Files at least this large are downsampled block by block
+STREAMING_BLOCK_SIZE = 1 << 18  # Samples (pre downsample) read per block when streaming
+STREAMING_OVERLAP = 1024  # Samples of context either side of a block; enough for the filter transients to vanish
 
 # Chunks (post downsample)
 CHUNK_SIZE_MS = 100  # Milliseconds, not megaseconds
 CHUNK_SIZE_S = CHUNK_SIZE_MS/1000
 NUM_SAMPS_IN_CHUNK = int(CHUNK_SIZE_MS * SAMP_RATE_MS)
+HOP_SIZE_MS = CHUNK_SIZE_MS  # Distance between the starts of consecutive chunks; less than CHUNK_SIZE_MS overlaps them
+HOP_SIZE_S = HOP_SIZE_MS/1000
+NUM_SAMPS_IN_HOP = int(HOP_SIZE_MS * SAMP_RATE_MS)
+
+# Spectral features
+FFT_WINDOW = None  # Any window name understood by scipy.signal.get_window, e.g. 'hann'
+FFT_LOG_MAGNITUDE = False
+FFT_BLOCK_SIZE = 4096  # Chunks transformed per vectorized call; bounds temporary memory
+
+# Training
+TRAINING_PREFETCH_BATCHES = 4  # Batches prepared ahead of the training loop
+CLASSIFIER_WORKERS = None  # Processes the classifiers are fitted in; None uses every core
+SHARD_SIZE = 16384  # Chunks per on-disk training shard
+
+# Diarization
+DIARIZATION_WORKERS = None  # Processes files are annotated in; None uses every core
+MODEL_SESSION_CACHE_SIZE = 2  # Loaded models each process keeps ready
+PIPELINE_QUEUE_SIZE = 2  # Files each pipeline stage may run ahead of the next
+PROGRESS_CHUNKS = 600  # Chunks evaluated between progress reports and cancellation checks
+
+# Silence pre-filter
+SILENCE_THRESHOLD_DB = -50  # Chunks with every channel quieter than this (dB of int16 full scale) skip the model; None disables
+SILENCE_NOISE_MARGIN_DB = 10  # Up to this much louder, chunks are still silent if they cross zero as often as noise does
+SILENCE_NOISE_ZERO_CROSSING_RATE = 0.4  # Fraction of consecutive samples changing sign above which a chunk is noise-like
+
+# Post-processing
+SMOOTHING = 'moving_average'  # 'moving_average', 'median' or 'viterbi' (two state HMM decoding of each speaker)
+SMOOTHING_WINDOW = 5  # Chunks in the centred moving average or median window; must be odd
+SMOOTHING_SWITCH_PROBABILITY = 0.05  # Chance per chunk that the HMM switches between silent and speaking
+SMOOTHING_MAX_DELAY = 50  # Most chunks the HMM holds back undecided before deciding from the best state so far
+
+# Scoring
+SCORING_WORKERS = None  # Processes files are scored in; None uses every core
+
+# Feature cache
+USE_FEATURE_CACHE = True
+FEATURE_CACHE_LOCATION = 'Data/Cache/'
+FEATURE_CACHE_MAX_BYTES = 4 * 1024 ** 3  # Least recently used entries are evicted past this size
 
 # TensorFlow Log File
-now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
 ROOT_LOGDIR = "tf_logs"
-LOGDIR = "{}/run-{}/".format(ROOT_LOGDIR, now)
+
+
+def __getattr__(name):
+    # LOGDIR is timestamped when first used rather than whenever the constants are imported
+    if name == 'LOGDIR':
+        global LOGDIR
+        now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        LOGDIR = "{}/run-{}/".format(ROOT_LOGDIR, now)
+        return LOGDIR
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,88 @@
+"""This module is an encapsulator for the DiarizationPipeline class."""
+import queue
+import threading
+import time
+from software_model.network_data_postprocessor import NetworkDataPostprocessor
+from software_model.constants import PREDICTON_FILES_LOCATION, PIPELINE_QUEUE_SIZE
+
+_END_OF_FILES = object()
+
+
+class DiarizationPipeline:
+    """Annotates several files with a Diarizer, overlapping the disk bound and CPU bound stages of each.
+
+    A reader thread loads file N+1 while file N is evaluated, and a writer thread writes the csv files of file N-1.
+    The stages are joined by bounded queues, so a fast stage blocks rather than running arbitrarily far ahead, and the
+    total time approaches that of the slowest stage rather than the sum of them."""
+
+    def __init__(self, diarizer, queue_size=PIPELINE_QUEUE_SIZE):
+        self._diarizer = diarizer
+        self._queue_size = queue_size
+
+    def run(self, wav_file_names, output_directory=PREDICTON_FILES_LOCATION):
+        """Annotates the files, returning a dict of the seconds each file spent in the read, compute and write stages."""
+        timings = {wav_file_name: {} for wav_file_name in wav_file_names}
+        read_queue = queue.Queue(maxsize=self._queue_size)
+        write_queue = queue.Queue(maxsize=self._queue_size)
+        errors = []
+
+        reader = threading.Thread(target=self._read, args=(wav_file_names, read_queue, timings, errors), daemon=True)
+        writer = threading.Thread(target=self._write, args=(write_queue, timings, errors), daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            while True:
+                item = read_queue.get()
+                if item is _END_OF_FILES:
+                    break
+                wav_file_name, network_input = item
+
+                start = time.perf_counter()
+                postprocessor = NetworkDataPostprocessor(self._diarizer._evaluate(network_input), wav_file_name,
+                                                         output_directory)
+                csv_data = postprocessor.get_csv_data()
+                timings[wav_file_name]['compute'] = time.perf_counter() - start
+
+                write_queue.put((wav_file_name, postprocessor, csv_data))
+        finally:
+            write_queue.put(_END_OF_FILES)
+            writer.join()
+            # Unblock the reader if the pipeline stopped early
+            while reader.is_alive():
+                try:
+                    read_queue.get_nowait()
+                except queue.Empty:
+                    reader.join(0.01)
+
+        if errors:
+            raise errors[0]
+        return timings
+
+    def _read(self, wav_file_names, read_queue, timings, errors):
+        try:
+            for wav_file_name in wav_file_names:
+                start = time.perf_counter()
+                network_input = self._diarizer._pre_processing(wav_file_name).load()
+                timings[wav_file_name]['read'] = time.perf_counter() - start
+                read_queue.put((wav_file_name, network_input))
+        except Exception as error:
+            errors.append(error)
+        finally:
+            read_queue.put(_END_OF_FILES)
+
+    def _write(self, write_queue, timings, errors):
+        while True:
+            item = write_queue.get()
+            if item is _END_OF_FILES:
+                return
+            if errors:
+                continue
+
+            wav_file_name, postprocessor, csv_data = item
+            try:
+                start = time.perf_counter()
+                postprocessor.write_csv_data(csv_data)
+                timings[wav_file_name]['write'] = time.perf_counter() - start
+            except Exception as error:
+                errors.append(error)
@@ -0,0 +1,121 @@
+"""This module scores predicted _SpkN.csv segments against the reference annotations of the same recordings.
+
+Segments are compared as intervals, so nothing is resampled to a time grid and the cost is that of sorting their
+boundaries. Each speaker is a fixed tier of its recording, so no speakers need mapping and there is no confusion
+error: the error rate is the missed plus falsely detected speech over the reference speech."""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import os
+import re
+import warnings
+import numpy as np
+from software_model.constants import DATA_FILES_LOCATION, PREDICTON_FILES_LOCATION, SCORING_WORKERS
+
+
+def read_speech_intervals(csv_file):
+    """Returns a (num_segments, 2) array of the start and end times of the speaking segments in a segment csv."""
+    with warnings.catch_warnings():
+        # A file without any segments is just its header
+        warnings.simplefilter('ignore', UserWarning)
+        segments = np.loadtxt(csv_file, dtype='float64', delimiter=',', skiprows=1, usecols=(0, 1, 2), ndmin=2)
+    return segments[segments[:, 2] != 0, :2]
+
+
+def score_intervals(reference, hypothesis):
+    """Returns the seconds of reference speech, missed speech and false alarm of one speaker's speech intervals.
+
+    The intervals needn't be sorted and may overlap. Every boundary is swept in time order, counting how many intervals
+    of each set are open, so scoring takes O(n log n) time."""
+    num_reference, num_hypothesis = reference.shape[0], hypothesis.shape[0]
+    times = np.concatenate((reference[:, 0], reference[:, 1], hypothesis[:, 0], hypothesis[:, 1]))
+    reference_changes = np.repeat([1, -1, 0, 0], [num_reference, num_reference, num_hypothesis, num_hypothesis])
+    hypothesis_changes = np.repeat([0, 0, 1, -1], [num_reference, num_reference, num_hypothesis, num_hypothesis])
+
+    # Between one boundary and the next, a set is speaking if any of its intervals is open
+    order = np.argsort(times, kind='stable')
+    durations = np.diff(times[order])
+    reference_speaking = np.cumsum(reference_changes[order])[:-1] > 0
+    hypothesis_speaking = np.cumsum(hypothesis_changes[order])[:-1] > 0
+
+    return {
+        'reference': float(durations[reference_speaking].sum()),
+        'miss': float(durations[reference_speaking & ~hypothesis_speaking].sum()),
+        'false_alarm': float(durations[~reference_speaking & hypothesis_speaking].sum()),
+    }
+
+
+def score_file(file_name, hypothesis_directory=PREDICTON_FILES_LOCATION, reference_directory=DATA_FILES_LOCATION):
+    """Scores each _SpkN.csv predicted for the named recording against the reference annotation of that speaker.
+
+    Returns a dict of the score of each speaker, by speaker number, and their 'total', each with its 'error_rate'.
+    Predictions without a reference annotation can't be scored, so they are listed under 'unmatched' instead."""
+    scores = {}
+    unmatched = []
+    for hypothesis_file in glob.glob(os.path.join(hypothesis_directory, glob.escape(file_name) + '_Spk*.csv')):
+        match = re.search(r'_Spk(\d+)\.csv$', hypothesis_file)
+        if match is None:
+            continue
+        reference_file = os.path.join(reference_directory, os.path.basename(hypothesis_file))
+        if not os.path.isfile(reference_file):
+            unmatched.append(os.path.basename(hypothesis_file))
+            continue
+        scores[int(match.group(1))] = _add_error_rate(score_intervals(read_speech_intervals(reference_file),
+                                                                      read_speech_intervals(hypothesis_file)))
+
+    return {'speakers': dict(sorted(scores.items())), 'total': get_total_score(scores.values()),
+            'unmatched': sorted(unmatched)}
+
+
+def score_directory(hypothesis_directory=PREDICTON_FILES_LOCATION, reference_directory=DATA_FILES_LOCATION,
+                    workers=SCORING_WORKERS, progress=None):
+    """Scores every recording with predictions in hypothesis_directory, scoring the files in parallel.
+
+    progress is called as progress(file_name, num_done, num_files, score) as each file is scored; by default the
+    progress is printed. Returns a dict of the score_file result of each recording with a reference annotation, the
+    'total' over them all, and the predictions which had no reference annotation, 'unmatched'."""
+    if progress is None:
+        progress = _print_score_progress
+
+    file_names = sorted(os.path.basename(hypothesis_file)[:-len('_Spk1.csv')]
+                        for hypothesis_file in glob.glob(os.path.join(hypothesis_directory, '*_Spk1.csv')))
+
+    scores = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(score_file, file_name, hypothesis_directory, reference_directory): file_name
+                   for file_name in file_names}
+        for future in as_completed(futures):
+            file_name = futures[future]
+            scores[file_name] = future.result()
+            progress(file_name, len(scores), len(file_names), scores[file_name])
+
+    # A recording none of whose predictions could be scored would only add a meaningless 0% to the results
+    matched = {file_name: score for file_name, score in sorted(scores.items()) if score['speakers']}
+    return {'files': matched, 'total': get_total_score(score['total'] for score in matched.values()),
+            'unmatched': sorted(unmatched for score in scores.values() for unmatched in score['unmatched'])}
+
+
+def get_total_score(scores):
+    """Sums the given scores, returning the total with its 'error_rate'."""
+    total = {'reference': 0.0, 'miss': 0.0, 'false_alarm': 0.0}
+    for score in scores:
+        for key in total:
+            total[key] += score[key]
+    return _add_error_rate(total)
+
+
+def _add_error_rate(score):
+    error = score['miss'] + score['false_alarm']
+    if score['reference'] > 0:
+        score['error_rate'] = error / score['reference']
+    else:
+        score['error_rate'] = float('inf') if error > 0 else 0.0
+    return score
+
+
+def _print_score_progress(file_name, num_done, num_files, score):
+    if not score['speakers']:
+        print("Skipped {} ({}/{}): no reference annotation".format(file_name, num_done, num_files))
+        return
+    skipped = " (no reference for {})".format(', '.join(score['unmatched'])) if score['unmatched'] else ''
+    print("Scored {} ({}/{}): {:.2%} error{}".format(file_name, num_done, num_files, score['total']['error_rate'],
+                                                     skipped))
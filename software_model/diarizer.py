@@ -1,24 +1,364 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import pickle
+import time
+import numpy as np
+from scipy.io import wavfile
 from software_model.network_data_preprocessor import NetworkDataPreprocessor
-from software_model.network_data_postprocessor import NetworkDataPostprocessor
+from software_model.network_data_postprocessor import NetworkDataPostprocessor, StreamingNetworkDataPostprocessor, \
+    get_csv_file_path, get_output_file_prefix
+from software_model.streaming_downsampler import StreamingDownsampler
+from software_model.chunk import ChunkBatch
+from software_model.feature_cache import FeatureCache
+from software_model.model_session_cache import ModelSessionCache
+from software_model.trained_model import TrainedModel
+from software_model.silence_detector import SilenceDetector
+from software_model.diarization_pipeline import DiarizationPipeline
+from software_model.audio_store import get_recording_location
+from software_model import instrumentation
+from software_model.instrumentation import stage
+from software_model.constants import USE_FEATURE_CACHE, ORIGINAL_SAMP_RATE_S, NUM_SAMPS_IN_CHUNK, \
+    NUM_SAMPS_IN_HOP, PREDICTON_FILES_LOCATION, DIARIZATION_WORKERS, PROGRESS_CHUNKS, NUM_CHANNELS, \
+    DOWNSAMPLE_FACTOR, RESAMPLER, CHUNK_SIZE_MS, HOP_SIZE_MS, SMOOTHING, SMOOTHING_WINDOW, \
+    SMOOTHING_SWITCH_PROBABILITY, SMOOTHING_MAX_DELAY, STREAMING_BLOCK_SIZE, SILENCE_THRESHOLD_DB, INPUT_SCALING
+
+CHECKPOINT_VERSION = 2
+
+
+def _load_network(neural_network_location):
+    return TrainedModel.load(neural_network_location)
+
+
+class DiarizationCancelled(Exception):
+    """Raised when an annotation is cancelled before it finishes."""
+
+
+# Loaded models are shared by every Diarizer in a process, so each is only loaded once per process
+_sessions = ModelSessionCache(_load_network)
 
 
 class Diarizer:
 
     def __init__(self, neural_network_location):
         self._neural_network_location = neural_network_location
+        self._feature_cache = FeatureCache() if USE_FEATURE_CACHE else None
+        self._silence_detector = SilenceDetector() if SILENCE_THRESHOLD_DB is not None else None
 
     def _pre_processing(self, wav_file_name):
-        return NetworkDataPreprocessor([wav_file_name]).get_all_chunks_in_file()
+        preprocessor = NetworkDataPreprocessor([wav_file_name], self._feature_cache)
+        network_input = preprocessor.get_all_chunks_in_file()
+        if self._feature_cache is None:
+            return network_input
 
-    def _post_processing(self, network_output, wav_file_name):
-        postprocessor = NetworkDataPostprocessor(network_output, wav_file_name)
+        # The spectra the network reads are cached along with the audio, so a warm re-run skips the FFT too
+        with stage('load_model'):
+            net = _sessions.get(self._neural_network_location)
+        if net.get_view().startswith('fft'):
+            channel = int(net.get_view()[-1])
+            network_input.set_features(channel, net.get_feature_extractor(),
+                                       preprocessor.get_features_in_file(net.get_feature_extractor(), channel))
+        return network_input
+
+    def _evaluate(self, network_input):
+        """Returns the speaker statuses of each chunk; chunks the silence detector finds silent skip the model."""
+        with stage('load_model'):
+            net = _sessions.get(self._neural_network_location)
+        if self._silence_detector is None:
+            with stage('evaluate'):
+                return net.evaluate_chunks(network_input)
+
+        speaking = np.flatnonzero(~self._silence_detector.get_silent_chunks(network_input))
+        if speaking.shape[0] == len(network_input):
+            with stage('evaluate'):
+                return net.evaluate_chunks(network_input)
+
+        network_output = np.zeros((len(network_input), NUM_CHANNELS))
+        if speaking.shape[0] > 0:
+            with stage('evaluate'):
+                network_output[speaking] = net.evaluate_chunks(network_input.take(speaking))
+        return network_output
+
+    def get_silence_stats(self):
+        """Returns the number of chunks this Diarizer evaluated in this process and how many skipped the model."""
+        if self._silence_detector is None:
+            return {'chunks': 0, 'silent_chunks': 0}
+        return self._silence_detector.get_stats()
+
+    def _post_processing(self, network_output, wav_file_name, output_directory=PREDICTON_FILES_LOCATION):
+        postprocessor = NetworkDataPostprocessor(network_output, wav_file_name, output_directory)
         postprocessor.write_to_csv()
 
-    def annotate_wav_file(self, wav_file_name):
-        network_input = self._pre_processing(wav_file_name)
-        net = NeuralNetwork()
-        network_output = net.evaluate_chunks(network_input, self._neural_network_location)
-        self._post_processing(network_output, wav_file_name)
+    def _evaluate_with_progress(self, network_input, progress, cancel):
+        """Evaluates PROGRESS_CHUNKS chunks at a time, reporting progress and checking for cancellation in between."""
+        num_chunks = len(network_input)
+        if num_chunks == 0:
+            return self._evaluate(network_input)
+
+        network_output = []
+        for start in range(0, num_chunks, PROGRESS_CHUNKS):
+            if cancel is not None and cancel.is_set():
+                raise DiarizationCancelled()
+
+            stop = min(start + PROGRESS_CHUNKS, num_chunks)
+            network_output.append(self._evaluate(network_input.get_chunks(start, stop)))
+            if progress is not None:
+                progress(stop, num_chunks)
+
+        return np.concatenate(network_output, axis=0)
+
+    def annotate_wav_file(self, wav_file_name, output_directory=PREDICTON_FILES_LOCATION, progress=None, cancel=None):
+        """Annotates a file, writing a csv of segments per speaker.
+
+        progress, if given, is called as progress(num_chunks_done, num_chunks) as evaluation proceeds. cancel may be a
+        threading.Event; once it is set the annotation stops with DiarizationCancelled and nothing is written."""
+        os.makedirs(output_directory, exist_ok=True)
+        with stage('annotate_wav_file'):
+            network_input = self._pre_processing(wav_file_name)
+            if progress is None and cancel is None:
+                network_output = self._evaluate(network_input)
+            else:
+                network_output = self._evaluate_with_progress(network_input, progress, cancel)
+            self._post_processing(network_output, wav_file_name, output_directory)
+
+    def annotate_wav_files(self, wav_file_names, output_directory=PREDICTON_FILES_LOCATION,
+                           workers=DIARIZATION_WORKERS):
+        """Annotates several files concurrently, returning a dict of the seconds each file took.
+
+        Each worker process loads the network once and reuses it for every file it is given, and while instrumentation
+        is enabled it records its stages too and hands them back with each file. With a single worker the files are run
+        through a DiarizationPipeline instead, overlapping reading, evaluating and writing."""
+        os.makedirs(output_directory, exist_ok=True)
+        if workers == 1:
+            timings = DiarizationPipeline(self).run(wav_file_names, output_directory)
+            return {wav_file_name: sum(stages.values()) for wav_file_name, stages in timings.items()}
+
+        profile = instrumentation.is_enabled()
+        trace_allocations = instrumentation.is_tracing_allocations()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {wav_file_name: executor.submit(self._timed_annotate_wav_file, wav_file_name, output_directory,
+                                                      profile, trace_allocations)
+                       for wav_file_name in wav_file_names}
+            timings = {}
+            for wav_file_name, future in futures.items():
+                timings[wav_file_name], records = future.result()
+                instrumentation.add_records(records)
+            return timings
+
+    def _timed_annotate_wav_file(self, wav_file_name, output_directory, profile=False, trace_allocations=False):
+        """Annotates a file in a worker process, returning the seconds it took and, if profiling, its stage records."""
+        if profile:
+            # A forked worker starts with a copy of the parent's records, and a worker is reused for several files
+            instrumentation.enable(trace_allocations=trace_allocations)
+            instrumentation.reset()
+        start = time.perf_counter()
+        self.annotate_wav_file(wav_file_name, output_directory)
+        seconds = time.perf_counter() - start
+        return seconds, instrumentation.get_records() if profile else []
+
+    def annotate_wav_file_incrementally(self, wav_file_name, output_directory=PREDICTON_FILES_LOCATION,
+                                        block_size=STREAMING_BLOCK_SIZE):
+        """Annotates the audio appended to a growing recording since it was last annotated, returning its sample count.
+
+        The state of the DiarizationStream the file is annotated with, and where the finished segments in its csvs
+        end, are saved in a .checkpoint file beside the csvs. Each run resumes from there, reading only the new audio
+        and appending the segments it finishes. The segments still open are then written as they stand, for the next
+        run to replace, so the csvs always cover the whole recording while each run costs only as much as the new audio.
+        The audio is scaled as annotate_wav_file scales it, so the csvs match those of annotating the whole file.
+        A checkpoint made with other settings, or for a longer file than is now there, is ignored and the file
+        annotated from the start."""
+        os.makedirs(output_directory, exist_ok=True)
+        with stage('annotate_wav_file'):
+            with stage('read_wav'):
+                audio = wavfile.read(get_recording_location(wav_file_name) + '.wav', mmap=True)[1]
+
+            checkpoint_file = get_output_file_prefix(wav_file_name, output_directory) + '.checkpoint'
+            checkpoint = self._load_checkpoint(checkpoint_file, wav_file_name, output_directory, audio.shape[0])
+            if checkpoint is None:
+                stream = self.open_stream()
+                num_samples = 0
+                csv_offsets = self._start_csv_files(wav_file_name, output_directory)
+            else:
+                stream = DiarizationStream.resume(checkpoint['stream'], self._evaluate)
+                num_samples = checkpoint['num_samples']
+                csv_offsets = checkpoint['csv_offsets']
+
+            rows = []
+            for start in range(num_samples, audio.shape[0], block_size):
+                rows.extend(stream.process(np.array(audio[start:start + block_size])))
+            state = pickle.dumps(stream)
+
+            # The finished segments replace the open ones written last time; the open ones are written after them
+            csv_offsets = self._write_csv_rows(wav_file_name, output_directory, rows, csv_offsets)
+            self._write_csv_rows(wav_file_name, output_directory, stream.flush(), csv_offsets)
+
+            checkpoint = {'version': CHECKPOINT_VERSION, 'settings': self._get_checkpoint_settings(),
+                          'num_samples': audio.shape[0], 'csv_offsets': csv_offsets, 'stream': state}
+            temporary_file = checkpoint_file + '.tmp'
+            with open(temporary_file, 'wb') as checkpoint_out:
+                pickle.dump(checkpoint, checkpoint_out)
+            os.replace(temporary_file, checkpoint_file)
+            return audio.shape[0] - num_samples
+
+    def _get_checkpoint_settings(self):
+        return {'DOWNSAMPLE_FACTOR': DOWNSAMPLE_FACTOR, 'RESAMPLER': RESAMPLER, 'INPUT_SCALING': INPUT_SCALING,
+                'CHUNK_SIZE_MS': CHUNK_SIZE_MS, 'HOP_SIZE_MS': HOP_SIZE_MS, 'SMOOTHING': SMOOTHING,
+                'SMOOTHING_WINDOW': SMOOTHING_WINDOW, 'SMOOTHING_SWITCH_PROBABILITY': SMOOTHING_SWITCH_PROBABILITY,
+                'SMOOTHING_MAX_DELAY': SMOOTHING_MAX_DELAY,
+                'silence': self._silence_detector.get_settings() if self._silence_detector is not None else None,
+                'model': os.path.abspath(self._neural_network_location)}
+
+    def _load_checkpoint(self, checkpoint_file, wav_file_name, output_directory, num_samples):
+        if not os.path.exists(checkpoint_file):
+            return None
+        with open(checkpoint_file, 'rb') as checkpoint_in:
+            checkpoint = pickle.load(checkpoint_in)
+
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint['settings'] != self._get_checkpoint_settings():
+            return None
+        if checkpoint['num_samples'] > num_samples:
+            return None
+        for speaker_id, offset in enumerate(checkpoint['csv_offsets']):
+            csv_file = get_csv_file_path(wav_file_name, output_directory, speaker_id)
+            if not os.path.exists(csv_file) or os.path.getsize(csv_file) < offset:
+                return None
+        return checkpoint
+
+    def _start_csv_files(self, wav_file_name, output_directory):
+        csv_offsets = []
+        for speaker_id in range(NUM_CHANNELS):
+            with open(get_csv_file_path(wav_file_name, output_directory, speaker_id), 'w', newline="\n",
+                      encoding="utf-8") as csvfile:
+                csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL).writerow(
+                    ['tmi0', 'tmax', 'text', 'tier'])
+                csv_offsets.append(csvfile.tell())
+        return csv_offsets
+
+    def _write_csv_rows(self, wav_file_name, output_directory, rows, csv_offsets):
+        """Writes each speaker's rows over whatever follows the given offset in its csv, returning the new ends."""
+        with stage('write_csv') as write_stage:
+            csv_ends = []
+            for speaker_id, offset in enumerate(csv_offsets):
+                with open(get_csv_file_path(wav_file_name, output_directory, speaker_id), 'r+', newline="\n",
+                          encoding="utf-8") as csvfile:
+                    csvfile.seek(offset)
+                    csvfile.truncate()
+                    writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                    writer.writerows(row for row in rows if row[3] == speaker_id + 1)
+                    csv_ends.append(csvfile.tell())
+                    write_stage.add_bytes_written(csv_ends[-1] - offset)
+            return csv_ends
+
+    def open_stream(self):
+        """Returns a DiarizationStream which annotates audio as it arrives."""
+        return DiarizationStream(self._evaluate)
+
+    def annotate_stream(self, pcm_blocks):
+        """Yields finished speaker segments, as CSV rows, while consuming an iterable of PCM blocks."""
+        # The silence counts are kept for the Diarizer's whole life, so only what they grow by is this stream's
+        silence_stats_before = self.get_silence_stats()
+        stream = self.open_stream()
+        for pcm_block in pcm_blocks:
+            yield from stream.process(pcm_block)
+        yield from stream.flush()
+
+        stats = stream.get_stats()
+        silence_stats = {key: count - silence_stats_before[key] for key, count in self.get_silence_stats().items()}
+        print("Annotated {:.1f}s of audio at a real-time factor of {:.3f}; maximum latency {:.2f}s; {} of {} chunks "
+              "skipped as silent".format(stats['audio_seconds'], stats['real_time_factor'],
+                                         stats['max_latency_seconds'], silence_stats['silent_chunks'],
+                                         silence_stats['chunks']))
 
     def train_network(self):
         None
+
+
+class DiarizationStream:
+    """Incrementally diarizes (num_samples, NUM_CHANNELS) blocks of PCM audio sampled at ORIGINAL_SAMP_RATE_S.
+
+    Audio is downsampled and chunked as it arrives and each complete chunk is evaluated straight away, so a segment
+    is returned at most one chunk plus half the smoothing window (and the downsampler's few ms of lookahead) after it
+    ends; Viterbi smoothing instead holds a segment back until its end can no longer change, but for no more than
+    SMOOTHING_MAX_DELAY chunks.
+    The audio is kept at its recorded int16 level, as files are with INPUT_SCALING = 'none', so the model sees the
+    same input as for the whole file. A stream never sees the whole recording, so it can't normalize by the
+    recording's peak, and 'peak' input scaling is refused."""
+
+    def __init__(self, evaluate, chunk_size=NUM_SAMPS_IN_CHUNK, hop_size=NUM_SAMPS_IN_HOP,
+                 input_scaling=INPUT_SCALING):
+        if input_scaling != 'none':
+            raise ValueError("Streams can only be annotated with INPUT_SCALING = 'none'; Given: " + str(input_scaling))
+
+        self._evaluate = evaluate
+        self._chunk_size = chunk_size
+        self._hop_size = hop_size
+        self._downsampler = StreamingDownsampler()
+        self._postprocessor = StreamingNetworkDataPostprocessor(chunk_size=chunk_size, hop_size=hop_size)
+        self._pending = None  # Downsampled audio not yet consumed by a whole chunk
+        self._samples_received = 0
+        self._processing_seconds = 0
+        self._max_latency_seconds = 0
+
+    def process(self, pcm_block):
+        """Accepts the next block of audio and returns the speaker segments it finished."""
+        start = time.perf_counter()
+        self._samples_received += pcm_block.shape[0]
+        rows = self._process_downsampled(self._downsampler.process(pcm_block), final=False)
+        self._processing_seconds += time.perf_counter() - start
+        return rows
+
+    def __getstate__(self):
+        # The stream is pickled as a checkpoint without its model, which resume reattaches
+        state = self.__dict__.copy()
+        del state['_evaluate']
+        return state
+
+    @classmethod
+    def resume(cls, state, evaluate):
+        """Returns the stream pickled in state, carrying on where it left off and evaluating chunks with evaluate."""
+        stream = pickle.loads(state)
+        stream._evaluate = evaluate
+        return stream
+
+    def flush(self):
+        """Processes the audio still held back and closes every open segment."""
+        start = time.perf_counter()
+        rows = self._process_downsampled(self._downsampler.flush(), final=True)
+        self._processing_seconds += time.perf_counter() - start
+        return rows
+
+    def get_stats(self):
+        audio_seconds = self._samples_received / ORIGINAL_SAMP_RATE_S
+        return {
+            'audio_seconds': audio_seconds,
+            'processing_seconds': self._processing_seconds,
+            'real_time_factor': self._processing_seconds / audio_seconds if audio_seconds else 0,
+            'max_latency_seconds': self._max_latency_seconds,
+        }
+
+    def _process_downsampled(self, downsampled, final):
+        int16_info = np.iinfo(np.dtype('int16'))
+        downsampled = np.clip(downsampled, int16_info.min, int16_info.max).astype(np.int16)
+        if self._pending is not None:
+            downsampled = np.concatenate((self._pending, downsampled), axis=0)
+
+        # The final partial chunks are padded by the ChunkBatch, just as for a whole file. Until then only whole chunks
+        # are evaluated, and the audio they overlap with the next chunk is held back along with the remainder
+        num_samps = downsampled.shape[0]
+        if final:
+            num_chunks = -(-num_samps // self._hop_size)
+        else:
+            num_chunks = (num_samps - self._chunk_size) // self._hop_size + 1 if num_samps >= self._chunk_size else 0
+        self._pending = downsampled[num_chunks * self._hop_size:]
+
+        rows = []
+        if num_chunks > 0:
+            chunk_batch = ChunkBatch(downsampled, self._chunk_size, self._hop_size, num_chunks)
+            rows = self._postprocessor.process(self._evaluate(chunk_batch))
+        if final:
+            rows.extend(self._postprocessor.flush())
+
+        received_seconds = self._samples_received / ORIGINAL_SAMP_RATE_S
+        for row in rows:
+            self._max_latency_seconds = max(self._max_latency_seconds, received_seconds - row[1])
+        return rows
@@ -0,0 +1,122 @@
+"""This module is an encapsulator for the FeatureCache class."""
+import hashlib
+import json
+import os
+import uuid
+import numpy as np
+from software_model.constants import DOWNSAMPLE_FACTOR, CHUNK_SIZE_MS, HOP_SIZE_MS, FEATURE_CACHE_LOCATION, FEATURE_CACHE_MAX_BYTES, \
+    INPUT_SCALING, RESAMPLER
+from software_model.instrumentation import stage
+
+CACHE_FORMAT_VERSION = 1
+
+
+class FeatureCache:
+    """An on-disk cache of per-file chunk and feature arrays, stored as .npy files.
+
+    Entries are keyed by the content hash of the source audio together with the pipeline constants and feature
+    settings that produced them, so changing any of those simply misses rather than returning stale data. Hits are
+    memory mapped, and the least recently used entries are evicted once the cache grows past max_bytes."""
+
+    def __init__(self, location=FEATURE_CACHE_LOCATION, max_bytes=FEATURE_CACHE_MAX_BYTES):
+        self._location = location
+        self._max_bytes = max_bytes
+        self._hash_index_file = os.path.join(location, 'hashes.json')
+        self._hash_index = None
+        os.makedirs(location, exist_ok=True)
+
+    def get_or_compute(self, source_file, name, settings, compute):
+        """Returns the cached array for the given source file, name and settings, computing and storing it on a miss."""
+        entry = self._get_entry_file(source_file, name, settings)
+
+        if os.path.exists(entry):
+            with stage('feature_cache_load') as load_stage:
+                # Touch the entry so that eviction is least recently used, not least recently written
+                os.utime(entry)
+                array = np.load(entry, mmap_mode='r')
+                load_stage.add_bytes_read(array.nbytes)
+            return array
+
+        array = np.ascontiguousarray(compute())
+        with stage('feature_cache_store') as store_stage:
+            temporary_entry = _get_temporary_file(entry)
+            with open(temporary_entry, 'wb') as entry_file:
+                np.save(entry_file, array)
+            os.replace(temporary_entry, entry)
+            store_stage.add_bytes_written(os.path.getsize(entry))
+            self._evict(keep=entry)
+
+        return np.load(entry, mmap_mode='r')
+
+    def clear(self):
+        for entry in self._get_entries():
+            os.remove(entry)
+
+    def _get_entry_file(self, source_file, name, settings):
+        key = json.dumps({
+            'version': CACHE_FORMAT_VERSION,
+            'source': self._get_content_hash(source_file),
+            'name': name,
+            'DOWNSAMPLE_FACTOR': DOWNSAMPLE_FACTOR,
+            'RESAMPLER': RESAMPLER,
+            'CHUNK_SIZE_MS': CHUNK_SIZE_MS,
+            'HOP_SIZE_MS': HOP_SIZE_MS,
+            'INPUT_SCALING': INPUT_SCALING,
+            'settings': settings,
+        }, sort_keys=True)
+        return os.path.join(self._location, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+    def _get_content_hash(self, source_file):
+        """Returns the sha1 of a file's contents, only rereading the file when its size or modification time change."""
+        if self._hash_index is None:
+            self._hash_index = self._read_hash_index()
+
+        stat = os.stat(source_file)
+        path = os.path.abspath(source_file)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+
+        known = self._hash_index.get(path)
+        if known is not None and known['fingerprint'] == fingerprint:
+            return known['sha1']
+
+        content_hash = hashlib.sha1()
+        with open(source_file, 'rb') as file_being_read:
+            for block in iter(lambda: file_being_read.read(1 << 20), b''):
+                content_hash.update(block)
+
+        self._hash_index[path] = {'fingerprint': fingerprint, 'sha1': content_hash.hexdigest()}
+        self._write_hash_index()
+        return self._hash_index[path]['sha1']
+
+    def _read_hash_index(self):
+        try:
+            with open(self._hash_index_file, 'r') as index_file:
+                return json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_hash_index(self):
+        temporary_index_file = _get_temporary_file(self._hash_index_file)
+        with open(temporary_index_file, 'w') as index_file:
+            json.dump(self._hash_index, index_file)
+        os.replace(temporary_index_file, self._hash_index_file)
+
+    def _get_entries(self):
+        return [os.path.join(self._location, f) for f in os.listdir(self._location) if f.endswith('.npy')]
+
+    def _evict(self, keep):
+        entries = [(os.stat(entry), entry) for entry in self._get_entries()]
+        total_bytes = sum(stat.st_size for stat, _ in entries)
+
+        for stat, entry in sorted(entries, key=lambda e: e[0].st_mtime_ns):
+            if total_bytes <= self._max_bytes:
+                break
+            if entry == keep:
+                continue
+            os.remove(entry)
+            total_bytes -= stat.st_size
+
+
+def _get_temporary_file(file_name):
+    # Unique, so concurrent writers never interleave in the same temporary file
+    return '{}.{}.tmp'.format(file_name, uuid.uuid4().hex)
@@ -0,0 +1,54 @@
+"""This module is an encapsulator for the FeatureExtractor class."""
+import numpy as np
+from scipy.fft import rfft
+from scipy.signal import get_window
+from software_model.constants import FFT_WINDOW, FFT_LOG_MAGNITUDE, FFT_BLOCK_SIZE
+from software_model.instrumentation import stage
+
+
+class FeatureExtractor:
+    """Computes the magnitude spectra of every chunk in a ChunkBatch with vectorized real-input FFTs."""
+
+    def __init__(self, window=FFT_WINDOW, log_magnitude=FFT_LOG_MAGNITUDE, block_size=FFT_BLOCK_SIZE):
+        self._window = window
+        self._log_magnitude = log_magnitude
+        self._block_size = block_size
+        self._window_cache = {}
+
+    def get_settings(self):
+        """Returns the settings which determine the extracted features."""
+        return {'window': self._window, 'log_magnitude': self._log_magnitude}
+
+    def get_num_bins(self, chunk_size):
+        return chunk_size // 2 + 1
+
+    def extract(self, chunk_batch, channel):
+        """Returns a float32 (num_chunks, num_bins) matrix holding the spectrum of one channel of every chunk."""
+        with stage('fft'):
+            blocks = chunk_batch.get_blocks()
+            chunk_size = blocks[0].shape[1]
+            features = np.empty((len(chunk_batch), self.get_num_bins(chunk_size)), dtype=np.float32)
+
+            row = 0
+            for block in blocks:
+                for start in range(0, block.shape[0], self._block_size):
+                    samples = block[start:start + self._block_size, :, channel]
+                    features[row:row + samples.shape[0]] = self._spectrum(samples)
+                    row += samples.shape[0]
+
+            return features
+
+    def _spectrum(self, samples):
+        samples = samples.astype(np.float32)
+        if self._window is not None:
+            samples *= self._get_window(samples.shape[1])
+
+        spectrum = np.abs(rfft(samples, axis=1))
+        if self._log_magnitude:
+            np.log1p(spectrum, out=spectrum)
+        return spectrum
+
+    def _get_window(self, chunk_size):
+        if chunk_size not in self._window_cache:
+            self._window_cache[chunk_size] = get_window(self._window, chunk_size).astype(np.float32)
+        return self._window_cache[chunk_size]
@@ -0,0 +1,200 @@
+"""This module provides opt-in, per stage measurement of the pipeline.
+
+Wrap a stage of work in `with stage('name') as s:` and, while instrumentation is enabled, its wall time, CPU time,
+bytes read and written (reported through s.add_bytes_read / s.add_bytes_written) and, optionally, its peak Python and
+numpy allocations are recorded. Records are passed to any registered callbacks and summarized by get_report().
+While disabled, stage() hands back a shared object whose methods do nothing, so instrumented code costs next to
+nothing to run.
+
+CPU time is that of the whole process and allocation peaks are process wide, so both are approximate for stages
+which run concurrently on several threads."""
+import threading
+import time
+import tracemalloc
+
+_enabled = False
+_trace_allocations = False
+_callbacks = []
+_records = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable(callback=None, trace_allocations=False):
+    """Starts recording stages, optionally passing each record to callback and tracing allocations."""
+    global _enabled, _trace_allocations
+    if callback is not None:
+        add_callback(callback)
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _trace_allocations = trace_allocations
+    _enabled = True
+
+
+def disable():
+    global _enabled, _trace_allocations
+    _enabled = False
+    if _trace_allocations:
+        tracemalloc.stop()
+        _trace_allocations = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def is_tracing_allocations():
+    return _enabled and _trace_allocations
+
+
+def add_callback(callback):
+    """Registers callback(record) to be called with the record of every stage as it finishes."""
+    with _lock:
+        _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    with _lock:
+        _callbacks.remove(callback)
+
+
+def reset():
+    """Discards every record so far."""
+    with _lock:
+        _records.clear()
+
+
+def get_records():
+    with _lock:
+        return list(_records)
+
+
+def add_records(records):
+    """Adds records made elsewhere, such as in a worker process, passing each to the registered callbacks."""
+    with _lock:
+        _records.extend(records)
+        callbacks = list(_callbacks)
+    for record in records:
+        for callback in callbacks:
+            callback(record)
+
+
+def get_report():
+    """Returns a dict summarizing the records of each stage: its calls and total time, bytes and peak allocation."""
+    report = {}
+    for record in get_records():
+        summary = report.setdefault(record['stage'], {'calls': 0, 'wall_seconds': 0, 'cpu_seconds': 0,
+                                                      'bytes_read': 0, 'bytes_written': 0,
+                                                      'peak_allocated_bytes': None})
+        summary['calls'] += 1
+        for total in ('wall_seconds', 'cpu_seconds', 'bytes_read', 'bytes_written'):
+            summary[total] += record[total]
+        if record['peak_allocated_bytes'] is not None:
+            summary['peak_allocated_bytes'] = max(summary['peak_allocated_bytes'] or 0,
+                                                  record['peak_allocated_bytes'])
+    return report
+
+
+def print_report():
+    report = get_report()
+    if not report:
+        print("No stages were recorded")
+        return
+    print("{:<24}{:>7}{:>10}{:>10}{:>12}{:>12}{:>12}".format('stage', 'calls', 'wall s', 'cpu s', 'read MB',
+                                                              'written MB', 'peak MB'))
+    for name, summary in report.items():
+        peak = summary['peak_allocated_bytes']
+        print("{:<24}{:>7}{:>10.3f}{:>10.3f}{:>12.1f}{:>12.1f}{:>12}".format(
+            name, summary['calls'], summary['wall_seconds'], summary['cpu_seconds'], summary['bytes_read'] / 1e6,
+            summary['bytes_written'] / 1e6, '-' if peak is None else '{:.1f}'.format(peak / 1e6)))
+
+
+def stage(name):
+    """Returns a context manager measuring the enclosed stage of work while instrumentation is enabled."""
+    if not _enabled:
+        return _DISABLED_STAGE
+    return _Stage(name)
+
+
+class _DisabledStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add_bytes_read(self, num_bytes):
+        None
+
+    def add_bytes_written(self, num_bytes):
+        None
+
+
+_DISABLED_STAGE = _DisabledStage()
+
+
+class _Stage:
+
+    def __init__(self, name):
+        self._name = name
+        self._bytes_read = 0
+        self._bytes_written = 0
+        self._trace = _trace_allocations and tracemalloc.is_tracing()
+
+    def add_bytes_read(self, num_bytes):
+        self._bytes_read += num_bytes
+
+    def add_bytes_written(self, num_bytes):
+        self._bytes_written += num_bytes
+
+    def __enter__(self):
+        if self._trace:
+            # Fold the peak so far into the enclosing stage before resetting it for this one
+            stack = _get_stage_stack()
+            if stack:
+                stack[-1].fold_peak(tracemalloc.get_traced_memory()[1])
+            self._start_memory = tracemalloc.get_traced_memory()[0]
+            self._peak_memory = self._start_memory
+            tracemalloc.reset_peak()
+            stack.append(self)
+
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = {
+            'stage': self._name,
+            'wall_seconds': time.perf_counter() - self._start_wall,
+            'cpu_seconds': time.process_time() - self._start_cpu,
+            'bytes_read': self._bytes_read,
+            'bytes_written': self._bytes_written,
+            'peak_allocated_bytes': None,
+            'failed': exc_type is not None,
+        }
+
+        if self._trace:
+            self.fold_peak(tracemalloc.get_traced_memory()[1])
+            record['peak_allocated_bytes'] = self._peak_memory - self._start_memory
+            stack = _get_stage_stack()
+            stack.pop()
+            if stack:
+                stack[-1].fold_peak(self._peak_memory)
+            tracemalloc.reset_peak()
+
+        with _lock:
+            _records.append(record)
+            callbacks = list(_callbacks)
+        for callback in callbacks:
+            callback(record)
+        return False
+
+    def fold_peak(self, peak_memory):
+        self._peak_memory = max(self._peak_memory, peak_memory)
+
+
+def _get_stage_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
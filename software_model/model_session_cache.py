@@ -0,0 +1,31 @@
+"""This module is an encapsulator for the ModelSessionCache class."""
+from collections import OrderedDict
+import threading
+from software_model.constants import MODEL_SESSION_CACHE_SIZE
+
+
+class ModelSessionCache:
+    """A small least recently used cache of loaded models, keyed by the location they were loaded from."""
+
+    def __init__(self, loader, max_size=MODEL_SESSION_CACHE_SIZE):
+        self._loader = loader
+        self._max_size = max_size
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, location):
+        """Returns the model at the given location, loading it only if it isn't already cached."""
+        with self._lock:
+            if location in self._models:
+                self._models.move_to_end(location)
+                return self._models[location]
+
+            model = self._loader(location)
+            self._models[location] = model
+            if len(self._models) > self._max_size:
+                self._models.popitem(last=False)
+            return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
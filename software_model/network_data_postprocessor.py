@@ -1,57 +1,143 @@
+import os
 import numpy as np
-from software_model.constants import PREDICTON_FILES_LOCATION, CHUNK_SIZE_S
+from software_model.constants import PREDICTON_FILES_LOCATION, NUM_SAMPS_IN_CHUNK, NUM_SAMPS_IN_HOP, SAMP_RATE_S, \
+    SMOOTHING, SMOOTHING_WINDOW
 import csv
+from software_model.instrumentation import stage
+from software_model.smoother import Smoother, smooth
+
+
+def chunk_indices_to_times(chunk_indices, chunk_size=NUM_SAMPS_IN_CHUNK, hop_size=NUM_SAMPS_IN_HOP):
+    """Returns the time, in seconds, of the segment boundary before each of the given chunk indices.
+
+    Each chunk is credited with the hop at the centre of its window, so overlapping chunks still give contiguous
+    segments with boundaries at the resolution of the hop. Without overlap this is simply the chunk's start time.
+    Chunks start every hop_size downsampled samples, which is a little less than HOP_SIZE_MS whenever the hop is not
+    a whole number of samples, so times are counted in samples to stay on the chunks over long recordings."""
+    chunk_indices = np.asarray(chunk_indices)
+    times = (chunk_indices * hop_size + (chunk_size - hop_size) / 2) / SAMP_RATE_S
+    return np.round(np.where(chunk_indices == 0, 0, times), 6)
+
+
+def get_output_file_prefix(wav_file_name, output_directory):
+    """Returns the path, less its suffix, of the files written in output_directory for a recording."""
+    # Recordings named by their path are written under their file name alone
+    file_name = os.path.basename(wav_file_name)
+    if file_name.endswith('.wav'):
+        file_name = file_name[:-len('.wav')]
+    return os.path.join(output_directory, file_name)
+
+
+def get_csv_file_path(wav_file_name, output_directory, speaker_id):
+    """Returns the path of the csv the segments of the given speaker (counting from 0) of a recording are written to."""
+    return get_output_file_prefix(wav_file_name, output_directory) + "_Spk" + str(speaker_id + 1) + ".csv"
 
 
 class NetworkDataPostprocessor:
 
-    def __init__(self, network_output, wav_file_name):
+    def __init__(self, network_output, wav_file_name, output_directory=PREDICTON_FILES_LOCATION, smoothing=SMOOTHING,
+                 window=SMOOTHING_WINDOW):
         self._network_output = network_output
         self._wav_file_name = wav_file_name
+        self._output_directory = output_directory
+        self._smoothing = smoothing
+        self._window = window
 
     def write_to_csv(self):
-        speaker0_prediction_array = self._network_output[:, 0]
-        speaker1_prediction_array = self._network_output[:, 1]
+        self.write_csv_data(self.get_csv_data())
 
-        speaker0_prediction_array = self._moving_average(speaker0_prediction_array)
-        speaker1_prediction_array = self._moving_average(speaker1_prediction_array)
+    def get_csv_data(self):
+        """Smooths and segments the network output, returning a list of csv rows per speaker."""
+        with stage('segment'):
+            prediction_array = np.round(smooth(self._network_output, self._smoothing, self._window))
 
-        speaker0_prediction_array = np.round(speaker0_prediction_array)
-        speaker1_prediction_array = np.round(speaker1_prediction_array)
+            return self._prediction_array_to_csv_data(prediction_array)
 
-        speaker0_csv_array = self._prediction_array_to_csv_data(speaker0_prediction_array, 0)
-        speaker1_csv_array = self._prediction_array_to_csv_data(speaker1_prediction_array, 1)
+    def write_csv_data(self, csv_data):
+        with stage('write_csv') as write_stage:
+            for speaker_id, prediction_array_as_csv_data in enumerate(csv_data):
+                write_stage.add_bytes_written(
+                    self.__write_csv_file(prediction_array_as_csv_data, self._wav_file_name, speaker_id))
 
-        self.__write_csv_file(speaker0_csv_array, self._wav_file_name, 0)
-        self.__write_csv_file(speaker1_csv_array, self._wav_file_name, 1)
+    def _prediction_array_to_csv_data(self, prediction_array):
+        """Run-length encodes a (num_chunks, num_speakers) prediction array into a list of csv rows per speaker.
 
-    def _prediction_array_to_csv_data(self, predict_array, speaker_id):
+        Every speaker is encoded at once, and times are computed from chunk indices so they don't drift."""
+        num_chunks, num_speakers = prediction_array.shape
 
-        start_time_in_block = 0
-        current_time_in_block = 0
-        toggle = predict_array[0]
+        # A segment starts at the first chunk and wherever a speaker's prediction changes
+        is_start = np.ones((num_speakers, num_chunks), dtype=bool)
+        is_start[:, 1:] = prediction_array[1:].T != prediction_array[:-1].T
+        speaker_ids, starts = np.nonzero(is_start)
 
-        to_return = []
+        # Each segment ends where the speaker's next one starts, or at the end of the file
+        ends = np.append(starts[1:], num_chunks)
+        ends[np.append(speaker_ids[1:] != speaker_ids[:-1], True)] = num_chunks
 
-        for value in predict_array:
-            current_time_in_block += CHUNK_SIZE_S
-            if value != toggle:
-                toggle = value
-                to_return.append([round(start_time_in_block, 6), round(current_time_in_block, 6), int(toggle), speaker_id + 1])
-                start_time_in_block = current_time_in_block
-        # Add value for the very last block
-        to_return.append([round(start_time_in_block, 6), round(current_time_in_block, 6), int(toggle), speaker_id + 1])
+        rows = list(zip(chunk_indices_to_times(starts).tolist(), chunk_indices_to_times(ends).tolist(),
+                        prediction_array[starts, speaker_ids].astype(int).tolist(), (speaker_ids + 1).tolist()))
 
-        return to_return
+        speaker_bounds = np.searchsorted(speaker_ids, np.arange(num_speakers + 1))
+        return [rows[speaker_bounds[i]:speaker_bounds[i + 1]] for i in range(num_speakers)]
 
     def __write_csv_file(self, prediction_array_as_csv_data, file_name, speaker_id):
-        with open(PREDICTON_FILES_LOCATION + file_name + "_Spk" + str(speaker_id + 1) + ".csv", 'w', newline="\n", encoding="utf-8") as csvfile:
+        with open(get_csv_file_path(file_name, self._output_directory, speaker_id), 'w', newline="\n", encoding="utf-8") as csvfile:
             writer = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
             # Write the header
             writer.writerow(['tmi0', 'tmax', 'text', 'tier'])
-            for row in prediction_array_as_csv_data:
-                writer.writerow(row)
+            writer.writerows(prediction_array_as_csv_data)
+            return csvfile.tell()
+
+
+class StreamingNetworkDataPostprocessor:
+    """Smooths and segments network output that arrives a block of chunks at a time.
+
+    The smoothing state and any still open segments are carried from one block to the next, so the segments match
+    those of smoothing the whole output at once. Segments are returned as CSV rows as soon as they end."""
+
+    def __init__(self, num_speakers=2, smoothing=SMOOTHING, window=SMOOTHING_WINDOW, chunk_size=NUM_SAMPS_IN_CHUNK,
+                 hop_size=NUM_SAMPS_IN_HOP):
+        self._smoother = Smoother(smoothing, window)
+        self._chunk_size = chunk_size
+        self._hop_size = hop_size
+        self._num_smoothed = 0
+        self._open_segments = [None] * num_speakers  # [start chunk index, value] of each speaker's current segment
+
+    def process(self, network_output):
+        """Accepts the next (num_chunks, num_speakers) block of network output and returns the finished segments."""
+        return self._segment_smoothed(self._smoother.process(network_output))
+
+    def flush(self):
+        """Closes and returns every open segment."""
+        rows = self._segment_smoothed(self._smoother.flush())
+        for speaker_id, segment in enumerate(self._open_segments):
+            if segment is not None:
+                rows.append(self._to_row(segment[0], self._num_smoothed, segment[1], speaker_id))
+                self._open_segments[speaker_id] = None
+        return rows
+
+    def _segment_smoothed(self, smoothed):
+        rows = []
+        if smoothed.shape[0] > 0:
+            smoothed = np.round(smoothed)
+            for speaker_id in range(smoothed.shape[1]):
+                rows.extend(self._segment(smoothed[:, speaker_id], speaker_id))
+            self._num_smoothed += smoothed.shape[0]
+        return rows
+
+    def _segment(self, smoothed, speaker_id):
+        if self._open_segments[speaker_id] is None:
+            self._open_segments[speaker_id] = [self._num_smoothed, smoothed[0]]
+
+        values = np.concatenate(([self._open_segments[speaker_id][1]], smoothed))
+        rows = []
+        for change in np.flatnonzero(np.diff(values)):
+            start, value = self._open_segments[speaker_id]
+            end = self._num_smoothed + change
+            rows.append(self._to_row(start, end, value, speaker_id))
+            self._open_segments[speaker_id] = [end, values[change + 1]]
+        return rows
 
-    def _moving_average(self, data_array, window=5):
-        data_array = np.array(data_array)
-        return np.convolve(data_array, np.ones((window,)) / window, mode='valid')
+    def _to_row(self, start_index, end_index, value, speaker_id):
+        start_time, end_time = chunk_indices_to_times([start_index, end_index], self._chunk_size, self._hop_size)
+        return [float(start_time), float(end_time), int(value), speaker_id + 1]
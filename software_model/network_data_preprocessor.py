@@ -1,66 +1,136 @@
-from math import ceil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
 import numpy as np
-from scipy.signal import decimate
+from scipy.signal import decimate, resample_poly
 from scipy.io import wavfile
-from software_model.constants import DATA_FILES_LOCATION, DOWNSAMPLE_FACTOR, NUM_SAMPS_IN_CHUNK, SAVE_DOWNSAMPLED_FILES
-from software_model.chunk import Chunk
-import os
+from software_model.constants import DOWNSAMPLE_FACTOR, NUM_SAMPS_IN_CHUNK, NUM_SAMPS_IN_HOP, RESAMPLER, \
+    DOWNSAMPLE_WORKERS, STREAMING_DOWNSAMPLE_MIN_BYTES, INPUT_SCALING
+from software_model.streaming_downsampler import downsample_file_streaming
+from software_model.audio_store import AudioStore, get_recording_location, get_downsampled_file
+from software_model.chunk import Chunk, ChunkBatch
+from software_model.instrumentation import stage
 
 
 class NetworkDataPreprocessor:
 
-    def __init__(self, file_list):
+    def __init__(self, file_list, feature_cache=None):
         self._file_list = file_list
+        self._feature_cache = feature_cache
         self._audio = self.read_wav_files()
         self.num_files = len(file_list)
 
     def read_wav_files(self):
-        """This method reads in .wav sound files."""
-        files_to_return = []
-
-        try:
-            files_to_return = list(
-                np.array(wavfile.read(DATA_FILES_LOCATION + file_name + '_downsampled.wav')[1]) for file_name in self._file_list)
-
-        except FileNotFoundError:
-            # If the file isn't found, attempt to see if the file simply hasn't been downsampled yet and do so.
-            for file_name in self._file_list:
-                self.downsample(DATA_FILES_LOCATION + file_name + '.wav', DATA_FILES_LOCATION + file_name + '_downsampled.wav', DOWNSAMPLE_FACTOR)
-            # Retry Reading the files again
-            files_to_return = list(np.array(wavfile.read(DATA_FILES_LOCATION + file_name + '_downsampled.wav')[1]) for file_name in self._file_list)
+        """This method gives lazy, memory mapped access to the .wav sound files."""
+        return AudioStore(self._file_list, self.downsample)
 
-        if SAVE_DOWNSAMPLED_FILES is False:
-            for file_name in self._file_list:
-                os.remove(DATA_FILES_LOCATION + file_name + '_downsampled.wav')
-        return files_to_return
+    def get_file_name(self, file_index):
+        return self._file_list[file_index]
 
     def get_chunk(self, file_index, chunk_index):
         """Retrives a specified chunk given a file index and chunk index"""
         audio_file = self._audio[file_index]
 
-        start = chunk_index * NUM_SAMPS_IN_CHUNK
+        start = chunk_index * NUM_SAMPS_IN_HOP
         end = start + NUM_SAMPS_IN_CHUNK
 
         chunk_data = audio_file[start:end, :]
 
         if end >= audio_file.shape[0]:
-            chunk_data = np.lib.pad(chunk_data, ((0, end - audio_file.shape[0]), (0, 0)), 'constant', constant_values=(0, 0))
+            chunk_data = np.pad(chunk_data, ((0, end - audio_file.shape[0]), (0, 0)), 'constant', constant_values=(0, 0))
 
         return Chunk(chunk_data)
 
     def get_all_chunks_in_file(self, file_index=0):
-        audio_file = self._audio[file_index]
-        num_chunks_in_file = ceil(audio_file.shape[0] / NUM_SAMPS_IN_CHUNK)
-        chunks = []
-        for i in range(num_chunks_in_file):
-            chunks.append(self.get_chunk(file_index, i))
+        """Returns a ChunkBatch viewing every chunk in the given file."""
+        if self._feature_cache is None:
+            audio = self._audio[file_index]
+            with stage('chunk'):
+                return ChunkBatch(audio)
+
+        audio = self._feature_cache.get_or_compute(self._audio.get_source_file(file_index), 'audio', {},
+                                                   lambda: self._audio[file_index])
+        with stage('chunk'):
+            return ChunkBatch(audio)
+
+    def get_features_in_file(self, feature_extractor, channel, file_index=0):
+        """Returns the (num_chunks, num_bins) spectral features of one channel of the given file."""
+        if self._feature_cache is None:
+            return self.get_all_chunks_in_file(file_index).get_features(channel, feature_extractor)
 
-        return chunks
+        return self._feature_cache.get_or_compute(
+            self._audio.get_source_file(file_index), 'fft' + str(channel), feature_extractor.get_settings(),
+            lambda: self.get_all_chunks_in_file(file_index).get_features(channel, feature_extractor))
 
     def downsample(self, infile, outfile, downsample_factor=DOWNSAMPLE_FACTOR):
         """Downsample an audio file"""
-        rate, aud = wavfile.read(infile)
+        downsample_file(infile, outfile, downsample_factor)
+
+
+def downsample_file(infile, outfile, downsample_factor=DOWNSAMPLE_FACTOR, resampler=RESAMPLER,
+                    input_scaling=INPUT_SCALING):
+    """Downsample an audio file, normalizing it to the full int16 range if input_scaling is 'peak'"""
+    if input_scaling not in ('none', 'peak'):
+        raise ValueError("Input scaling must be 'none' or 'peak'; Given: " + str(input_scaling))
+
+    with stage('downsample') as downsample_stage:
+        downsample_stage.add_bytes_read(os.path.getsize(infile))
+        _downsample_file(infile, outfile, downsample_factor, resampler, input_scaling)
+        downsample_stage.add_bytes_written(os.path.getsize(outfile))
+
+
+def _downsample_file(infile, outfile, downsample_factor, resampler, input_scaling):
+    if os.path.getsize(infile) >= STREAMING_DOWNSAMPLE_MIN_BYTES:
+        downsample_file_streaming(infile, outfile, downsample_factor, resampler, input_scaling=input_scaling)
+        return
+
+    rate, aud = wavfile.read(infile)
+
+    if resampler == 'decimate':
         daud = decimate(aud, int(downsample_factor), axis=0)
-        int16_max = np.iinfo(np.dtype('int16')).max
-        daudint = np.int16(daud / np.max(np.abs(daud)) * int16_max)
-        wavfile.write(outfile, rate // downsample_factor, daudint)
+    elif resampler == 'polyphase':
+        daud = resample_poly(aud, 1, int(downsample_factor), axis=0)
+    else:
+        raise ValueError("Resampler must be 'decimate' or 'polyphase'; Given: " + str(resampler))
+
+    int16_info = np.iinfo(np.dtype('int16'))
+    if input_scaling == 'peak':
+        daud *= int16_info.max / np.max(np.abs(daud))
+    else:
+        # Kept at the recorded level, exactly as a DiarizationStream sees it
+        np.clip(daud, int16_info.min, int16_info.max, out=daud)
+    wavfile.write(outfile, rate // downsample_factor, daud.astype(np.int16))
+
+
+def downsample_files(file_list, workers=DOWNSAMPLE_WORKERS, resampler=RESAMPLER, overwrite=False, progress=None):
+    """Downsample the .wav files of the given names in parallel, writing the downsampled files read_wav_files expects.
+
+    progress is called as progress(file_name, num_done, num_files, seconds) as each file finishes; by default the
+    progress is printed. Returns a dict of the seconds taken by each file that was downsampled."""
+    if progress is None:
+        progress = _print_downsample_progress
+
+    if not overwrite:
+        file_list = [f for f in file_list if not os.path.exists(get_downsampled_file(f, resampler=resampler))]
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_timed_downsample_file, file_name, resampler): file_name for file_name in file_list}
+        for future in as_completed(futures):
+            file_name = futures[future]
+            timings[file_name] = future.result()
+            progress(file_name, len(timings), len(file_list), timings[file_name])
+
+    return timings
+
+
+def _timed_downsample_file(file_name, resampler):
+    start = time.perf_counter()
+    recording_location = get_recording_location(file_name)
+    downsample_file(recording_location + '.wav', get_downsampled_file(file_name, resampler=resampler), DOWNSAMPLE_FACTOR,
+                    resampler)
+    return time.perf_counter() - start
+
+
+def _print_downsample_progress(file_name, num_done, num_files, seconds):
+    print("Downsampled {} ({}/{}) in {:.2f}s".format(file_name, num_done, num_files, seconds))
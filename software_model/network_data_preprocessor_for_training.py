@@ -1,87 +1,91 @@
 """This module is an encapsulator for the NetworkDataPreprocessorForTraining class."""
-import csv
 from math import ceil
 import random as rand
 import numpy as np
-from software_model.constants import DATA_FILES_LOCATION, SAMP_RATE_S, NUM_SAMPS_IN_CHUNK
+from software_model.constants import SAMP_RATE_S, NUM_SAMPS_IN_CHUNK, NUM_SAMPS_IN_HOP
 from software_model.network_data_preprocessor import NetworkDataPreprocessor
+from software_model.annotation_index import AnnotationIndex
+from software_model.audio_store import get_recording_location
+from software_model.training_batch_sampler import TrainingBatchSampler
 
 
 class NetworkDataPreprocessorForTraining(NetworkDataPreprocessor):
 
-    def __init__(self, file_list):
-        NetworkDataPreprocessor.__init__(self, file_list)
+    def __init__(self, file_list, feature_cache=None):
+        NetworkDataPreprocessor.__init__(self, file_list, feature_cache)
 
         self._spk1 = self.__get_speaker('_Spk1')
         self._spk2 = self.__get_speaker('_Spk2')
 
     def __get_speaker(self, ext):
         """This method reads in speaking/non-speaking data from a csv file for a given speaker."""
-        return list(self.__read_annotations_from_csv(f, ext) for f in self._file_list)
-
-    def __read_annotations_from_csv(self, file_name, ext):
-        """This method reads and parses the speaking/non-speaking data from a csv file."""
-        spk = []
-        with open(DATA_FILES_LOCATION + file_name + ext + '.csv', 'r') as file_being_read:
-            reader = csv.reader(file_being_read)
-            # Skip the header line
-            next(file_being_read)
-            for row in reader:
-                spk.append(np.array(row[1:3], dtype='float32'))
-        return np.array(spk)
+        return list(AnnotationIndex.from_csv(get_recording_location(f) + ext + '.csv') for f in self._file_list)
 
     def get_annotated_chunk(self, file_index, chunk_index):
         """Retrives a specified chunk given a file index and chunk index"""
+        chunk = self.get_chunk(file_index, chunk_index)
+        status = self.get_annotations_in_file(file_index, np.array([chunk_index]))[0]
 
-        spk1 = self._spk1[file_index]
-        spk2 = self._spk2[file_index]
+        return chunk, [int(status[0]), int(status[1])]
 
-        start = chunk_index * NUM_SAMPS_IN_CHUNK
+    def get_annotations_in_file(self, file_index, chunk_indices):
+        """Returns a (len(chunk_indices), 2) array of the speaker statuses at the midpoint of each given chunk."""
+        start = chunk_indices * NUM_SAMPS_IN_HOP
         end = start + NUM_SAMPS_IN_CHUNK
 
         midpoint_samp = (start + end) // 2
         midpoint_sec = midpoint_samp / SAMP_RATE_S
 
-        spk1_bin = np.digitize(midpoint_sec, spk1[:, 0])
-        spk2_bin = np.digitize(midpoint_sec, spk2[:, 0])
+        return np.stack((self._spk1[file_index].get_statuses(midpoint_sec),
+                         self._spk2[file_index].get_statuses(midpoint_sec)), axis=1)
 
-        # If the midpoint of the chunk is part of the padded section,
-        # There is no speaking here
-        if spk1_bin >= spk1.shape[0]:
-            spk1_status = 0
-        else:
-            spk1_status = int(spk1[spk1_bin, 1])
+    def get_all_annotated_chunks(self):
+        batch = []
+        response_variables = []
 
-        if spk2_bin >= spk2.shape[0]:
-            spk2_status = 0
-        else:
-            spk2_status = int(spk2[spk2_bin, 1])
+        for file_index in range(0, len(self._audio)):
+            chunk_batch = self.get_all_chunks_in_file(file_index)
+            batch.extend(chunk_batch)
+            response_variables.extend(self.get_annotations_in_file(file_index, np.arange(len(chunk_batch))).tolist())
 
-        chunk = self.get_chunk(file_index, chunk_index)
+        return batch, response_variables
 
-        return chunk, [spk1_status, spk2_status]
+    def get_all_annotated_features(self, feature_extractor):
+        """Returns a dict of dense (num_chunks, num_features) matrices, one per feature view, and a (num_chunks, 2)
+        array of the matching labels.
 
-    def get_all_annotated_chunks(self):
-        batch = []
+        The views are 'raw0'/'raw1' (the samples of each channel) and 'fft0'/'fft1' (their spectra)."""
+        features = {'raw0': [], 'raw1': [], 'fft0': [], 'fft1': []}
         response_variables = []
 
         for file_index in range(0, len(self._audio)):
-            audio_file = self._audio[file_index]
-            num_chunks_in_file = ceil(audio_file.shape[0] / NUM_SAMPS_IN_CHUNK)
-            for chunk_index in range(0, num_chunks_in_file):
-              chunk, status = self.get_annotated_chunk(file_index, chunk_index)
-              batch.append(chunk)
-              response_variables.append(status)  
+            chunk_batch = self.get_all_chunks_in_file(file_index)
+            features['raw0'].append(chunk_batch.get_channel(0))
+            features['raw1'].append(chunk_batch.get_channel(1))
+            features['fft0'].append(self.get_features_in_file(feature_extractor, 0, file_index))
+            features['fft1'].append(self.get_features_in_file(feature_extractor, 1, file_index))
+            response_variables.append(self.get_annotations_in_file(file_index, np.arange(len(chunk_batch))))
+
+        features = {view: np.concatenate(matrices, axis=0) for view, matrices in features.items()}
+        return features, np.concatenate(response_variables, axis=0)
+
+    def get_batch_sampler(self, feature_extractor, batch_size, **sampler_options):
+        """Returns a TrainingBatchSampler over every annotated chunk of every file."""
+        features, response_variables = self.get_all_annotated_features(feature_extractor)
+        return TrainingBatchSampler(features, response_variables, batch_size, self.get_file_offsets()[:-1],
+                                    **sampler_options)
+
+    def get_file_offsets(self):
+        """Returns the row at which each file starts in get_all_annotated_features, followed by the total row count."""
+        chunks_per_file = [len(self.get_all_chunks_in_file(file_index)) for file_index in range(len(self._audio))]
+        return np.cumsum([0] + chunks_per_file)
 
-        return batch, response_variables
-        
-        
     def get_random_annotated_chunk(self):
         """Gets a random chunk from a random file provided in the class initialization."""
 
         file_index = rand.randint(0, len(self._audio) - 1)
         audio_file = self._audio[file_index]
-        num_chunks_in_file = ceil(audio_file.shape[0] / NUM_SAMPS_IN_CHUNK)
+        num_chunks_in_file = ceil(audio_file.shape[0] / NUM_SAMPS_IN_HOP)
         chunk_index = rand.randint(0, num_chunks_in_file - 1)
 
         return self.get_annotated_chunk(file_index, chunk_index)
@@ -0,0 +1,169 @@
+"""This module provides export of annotated training data to on-disk shards, and the ShardedDataset reading them."""
+import json
+import os
+import numpy as np
+from software_model.constants import DOWNSAMPLE_FACTOR, CHUNK_SIZE_MS, HOP_SIZE_MS, SHARD_SIZE, INPUT_SCALING, \
+    RESAMPLER
+
+INDEX_FILE = 'index.json'
+SHARD_FORMAT_VERSION = 1
+
+
+def export_shards(preprocessor, feature_extractor, output_directory, shard_size=SHARD_SIZE):
+    """Writes the features and labels of every chunk of a NetworkDataPreprocessorForTraining's files to shards.
+
+    Each shard holds shard_size chunks as one .npy file per feature view plus one of labels, and index.json records
+    the shards, the files they came from and the settings they were made with. Only one file and one shard are held
+    in memory at a time."""
+    os.makedirs(output_directory, exist_ok=True)
+    writer = _ShardWriter(output_directory, shard_size)
+    files = []
+
+    for file_index in range(preprocessor.num_files):
+        chunk_batch = preprocessor.get_all_chunks_in_file(file_index)
+        features = {
+            'raw0': chunk_batch.get_channel(0),
+            'raw1': chunk_batch.get_channel(1),
+            'fft0': preprocessor.get_features_in_file(feature_extractor, 0, file_index),
+            'fft1': preprocessor.get_features_in_file(feature_extractor, 1, file_index),
+        }
+        labels = preprocessor.get_annotations_in_file(file_index, np.arange(len(chunk_batch)))
+
+        files.append({'name': preprocessor.get_file_name(file_index), 'first_row': writer.num_rows,
+                      'num_chunks': len(chunk_batch)})
+        writer.add(features, labels)
+
+    writer.close()
+
+    index = {
+        'version': SHARD_FORMAT_VERSION,
+        'settings': {'DOWNSAMPLE_FACTOR': DOWNSAMPLE_FACTOR, 'CHUNK_SIZE_MS': CHUNK_SIZE_MS, 'HOP_SIZE_MS': HOP_SIZE_MS,
+                     'INPUT_SCALING': INPUT_SCALING, 'RESAMPLER': RESAMPLER,
+                     'features': feature_extractor.get_settings()},
+        'shards': writer.shards,
+        'files': files,
+    }
+    with open(os.path.join(output_directory, INDEX_FILE), 'w') as index_file:
+        json.dump(index, index_file, indent=2)
+
+    return ShardedDataset(output_directory)
+
+
+class _ShardWriter:
+
+    def __init__(self, output_directory, shard_size):
+        self._output_directory = output_directory
+        self._shard_size = shard_size
+        self._pending = []
+        self._num_pending = 0
+        self.num_rows = 0
+        self.shards = []
+
+    def add(self, features, labels):
+        self._pending.append((features, labels))
+        self._num_pending += labels.shape[0]
+        self.num_rows += labels.shape[0]
+        while self._num_pending >= self._shard_size:
+            self._write_shard(self._shard_size)
+
+    def close(self):
+        if self._num_pending > 0:
+            self._write_shard(self._num_pending)
+
+    def _write_shard(self, num_rows):
+        # Only the rows of this shard are copied; the rest of a block split between shards stays pending as a view
+        blocks = []
+        num_taken = 0
+        while num_taken < num_rows:
+            features, labels = self._pending.pop(0)
+            num_wanted = num_rows - num_taken
+            if labels.shape[0] > num_wanted:
+                self._pending.insert(0, ({view: matrix[num_wanted:] for view, matrix in features.items()},
+                                         labels[num_wanted:]))
+                features, labels = {view: matrix[:num_wanted] for view, matrix in features.items()}, labels[:num_wanted]
+            blocks.append((features, labels))
+            num_taken += labels.shape[0]
+        self._num_pending -= num_rows
+
+        name = 'shard_{0:0=5d}'.format(len(self.shards))
+        for view in blocks[0][0]:
+            np.save(os.path.join(self._output_directory, name + '_' + view + '.npy'),
+                    np.concatenate([f[view] for f, _ in blocks], axis=0))
+        np.save(os.path.join(self._output_directory, name + '_labels.npy'),
+                np.concatenate([l for _, l in blocks], axis=0))
+        self.shards.append({'name': name, 'num_rows': num_rows})
+
+
+class ShardedDataset:
+    """Reads a dataset written by export_shards, memory mapping its shards.
+
+    get_features() and get_labels() return array-like objects which can be fancy indexed by global row just like
+    in-memory arrays, so a TrainingBatchSampler can sample from a dataset far larger than memory. iter_shards()
+    streams the dataset a shard at a time."""
+
+    def __init__(self, directory):
+        self._directory = directory
+        with open(os.path.join(directory, INDEX_FILE), 'r') as index_file:
+            self.index = json.load(index_file)
+
+        self.views = ['raw0', 'raw1', 'fft0', 'fft1']
+        self._shard_names = [shard['name'] for shard in self.index['shards']]
+        self._shard_offsets = np.cumsum([0] + [shard['num_rows'] for shard in self.index['shards']])
+        self.file_offsets = np.array([f['first_row'] for f in self.index['files']], dtype=np.int64)
+        self._mapped_shards = {}
+
+    def __len__(self):
+        return int(self._shard_offsets[-1])
+
+    def get_features(self):
+        """Returns a dict mapping each feature view to an array-like over every row of the dataset."""
+        return {view: _ShardedArray(self, view) for view in self.views}
+
+    def get_labels(self):
+        return _ShardedArray(self, 'labels')
+
+    def iter_shards(self, views=None):
+        """Yields the (features, labels) of each shard in turn, as memory mapped arrays."""
+        for shard_index in range(len(self._shard_names)):
+            features = {view: self.load_shard(shard_index, view) for view in (views or self.views)}
+            yield features, self.load_shard(shard_index, 'labels')
+
+    def load_shard(self, shard_index, name):
+        # Mapping a shard is cheap but not free, and batches revisit the same shards constantly
+        key = (shard_index, name)
+        if key not in self._mapped_shards:
+            self._mapped_shards[key] = np.load(
+                os.path.join(self._directory, self._shard_names[shard_index] + '_' + name + '.npy'), mmap_mode='r')
+        return self._mapped_shards[key]
+
+    def get_rows(self, name, rows):
+        """Gathers the given global rows of one view (or 'labels') from whichever shards hold them."""
+        rows = np.asarray(rows)
+        shard_indices = np.searchsorted(self._shard_offsets, rows, side='right') - 1
+
+        first_shard = self.load_shard(int(shard_indices[0]) if rows.size else 0, name)
+        gathered = np.empty(rows.shape + first_shard.shape[1:], dtype=first_shard.dtype)
+        for shard_index in np.unique(shard_indices):
+            in_shard = shard_indices == shard_index
+            shard = self.load_shard(int(shard_index), name)
+            gathered[in_shard] = shard[rows[in_shard] - self._shard_offsets[shard_index]]
+        return gathered
+
+    def get_shape(self, name):
+        return (len(self),) + self.load_shard(0, name).shape[1:]
+
+
+class _ShardedArray:
+
+    def __init__(self, dataset, name):
+        self._dataset = dataset
+        self._name = name
+        self.shape = dataset.get_shape(name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(self.shape[0]))
+        return self._dataset.get_rows(self._name, rows)
@@ -0,0 +1,60 @@
+"""This module is an encapsulator for the SilenceDetector class."""
+import numpy as np
+from software_model.constants import SILENCE_THRESHOLD_DB, SILENCE_NOISE_MARGIN_DB, SILENCE_NOISE_ZERO_CROSSING_RATE, \
+    FFT_BLOCK_SIZE
+from software_model.instrumentation import stage
+
+INT16_FULL_SCALE_POWER = float(np.iinfo(np.int16).max) ** 2
+
+
+class SilenceDetector:
+    """Finds the chunks of a ChunkBatch in which clearly nobody speaks, from each channel's energy and zero-crossings.
+
+    A channel is silent in a chunk if its mean power is below threshold_db, relative to int16 full scale, or if it is
+    at most noise_margin_db louder but crosses zero as often as broadband noise does, which voiced speech never does.
+    Only chunks where every channel is silent are reported. Counts of the chunks seen and found silent are kept."""
+
+    def __init__(self, threshold_db=SILENCE_THRESHOLD_DB, noise_margin_db=SILENCE_NOISE_MARGIN_DB,
+                 noise_zero_crossing_rate=SILENCE_NOISE_ZERO_CROSSING_RATE, block_size=FFT_BLOCK_SIZE):
+        self._threshold_db = threshold_db
+        self._noise_margin_db = noise_margin_db
+        self._noise_zero_crossing_rate = noise_zero_crossing_rate
+        self._block_size = block_size
+        self.num_chunks = 0
+        self.num_silent_chunks = 0
+
+    def get_settings(self):
+        """Returns the settings which determine which chunks are silent."""
+        return {'threshold_db': self._threshold_db, 'noise_margin_db': self._noise_margin_db,
+                'noise_zero_crossing_rate': self._noise_zero_crossing_rate}
+
+    def get_silent_chunks(self, chunk_batch):
+        """Returns a boolean array marking each chunk of the ChunkBatch in which every channel is silent."""
+        with stage('silence_filter'):
+            silent = np.empty(len(chunk_batch), dtype=bool)
+            row = 0
+            for block in chunk_batch.get_blocks():
+                for start in range(0, block.shape[0], self._block_size):
+                    samples = block[start:start + self._block_size]
+                    silent[row:row + samples.shape[0]] = self._is_silent(samples).all(axis=1)
+                    row += samples.shape[0]
+
+            self.num_chunks += silent.shape[0]
+            self.num_silent_chunks += int(np.count_nonzero(silent))
+            return silent
+
+    def get_stats(self):
+        return {'chunks': self.num_chunks, 'silent_chunks': self.num_silent_chunks}
+
+    def _is_silent(self, samples):
+        """Returns a (num_chunks, num_channels) boolean array marking the silent channels of each chunk."""
+        samples = samples.astype(np.float32)
+        power = np.mean(np.square(samples), axis=1)
+        power_db = 10 * np.log10(np.maximum(power / INT16_FULL_SCALE_POWER, 1e-12))
+
+        is_negative = samples < 0
+        zero_crossing_rate = np.mean(is_negative[:, 1:] != is_negative[:, :-1], axis=1)
+
+        return (power_db < self._threshold_db) | (
+            (power_db < self._threshold_db + self._noise_margin_db) &
+            (zero_crossing_rate > self._noise_zero_crossing_rate))
@@ -0,0 +1,129 @@
+import numpy as np
+from software_model.constants import SMOOTHING, SMOOTHING_WINDOW, SMOOTHING_SWITCH_PROBABILITY, SMOOTHING_MAX_DELAY
+
+SMOOTHING_METHODS = ('moving_average', 'median', 'viterbi')
+
+
+def smooth(network_output, method=SMOOTHING, window=SMOOTHING_WINDOW,
+           switch_probability=SMOOTHING_SWITCH_PROBABILITY, max_delay=SMOOTHING_MAX_DELAY):
+    """Smooths a whole (num_chunks, num_speakers) network output, returning an array of the same shape."""
+    smoother = Smoother(method, window, switch_probability, max_delay)
+    return np.concatenate((smoother.process(network_output), smoother.flush()), axis=0)
+
+
+class Smoother:
+    """Smooths every speaker's column of network output at once, a block of chunks at a time.
+
+    'moving_average' and 'median' filter over a window centred on each chunk, repeating the first and last outputs
+    past the edges, so the smoothed output stays aligned with the input. 'viterbi' decodes the most likely sequence
+    of silent and speaking states of each speaker, taking the output as the probability of speaking. A chunk is decided
+    once every path that can still turn out best agrees on it; as ties, such as a run of outputs of exactly 0.5, can
+    keep paths apart indefinitely, at most max_delay chunks are held back, and beyond that the oldest half of them are
+    decided from the best state so far.
+    Whatever the next block still needs is carried over, so the result is the same however the output is split into
+    blocks. Each smoothed chunk is returned as soon as later blocks can no longer change it; flush returns the rest."""
+
+    def __init__(self, method=SMOOTHING, window=SMOOTHING_WINDOW, switch_probability=SMOOTHING_SWITCH_PROBABILITY,
+                 max_delay=SMOOTHING_MAX_DELAY):
+        if method not in SMOOTHING_METHODS:
+            raise ValueError("Unknown smoothing method '{}'; expected one of {}".format(method, SMOOTHING_METHODS))
+        if window < 1 or window % 2 == 0:
+            raise ValueError("The smoothing window must be a positive odd number of chunks, not {}".format(window))
+        if max_delay < 2:
+            raise ValueError("The smoothing delay must be at least 2 chunks, not {}".format(max_delay))
+        self._method = method
+        self._window = window
+        self._max_delay = max_delay
+        self._num_speakers = None
+
+        # Windowed filters: the inputs the next outputs still need
+        self._history = None
+
+        # Viterbi decoding: the log score of the best path ending in each state, and for each chunk not yet returned
+        # after the first, the state each state was reached from
+        self._log_transitions = np.log([[1 - switch_probability, switch_probability],
+                                        [switch_probability, 1 - switch_probability]])
+        self._scores = None
+        self._back_pointers = []
+
+    def process(self, network_output):
+        """Accepts the next (num_chunks, num_speakers) block of network output and returns the chunks now smoothed."""
+        network_output = np.asarray(network_output, dtype=float)
+        self._num_speakers = network_output.shape[1]
+        if self._method == 'viterbi':
+            return self._decode(network_output, final=False)
+        return self._filter(network_output, final=False)
+
+    def flush(self):
+        """Returns every smoothed chunk still held back."""
+        remaining = np.empty((0, self._num_speakers or 0))
+        if self._num_speakers is None:
+            return remaining
+        if self._method == 'viterbi':
+            return self._decode(remaining, final=True)
+        return self._filter(remaining, final=True)
+
+    def _filter(self, network_output, final):
+        half_window = self._window // 2
+        if self._history is None:
+            if network_output.shape[0] == 0:
+                return network_output
+            self._history = np.repeat(network_output[:1], half_window, axis=0)
+
+        data = np.concatenate((self._history, network_output), axis=0)
+        if final:
+            data = np.concatenate((data, np.repeat(data[-1:], half_window, axis=0)), axis=0)
+        num_smoothed = max(data.shape[0] - (self._window - 1), 0)
+        self._history = data[num_smoothed:]
+
+        # Each window is summed in the same order whatever block it falls in, so blocks give identical results
+        windows = [data[offset:offset + num_smoothed] for offset in range(self._window)]
+        if self._method == 'median':
+            return np.median(np.stack(windows, axis=-1), axis=-1)
+        return sum(windows) / self._window
+
+    def _decode(self, network_output, final):
+        probabilities = np.clip(network_output, 1e-6, 1 - 1e-6)
+        log_emissions = np.log(np.stack((1 - probabilities, probabilities), axis=-1))  # (num_chunks, speakers, 2)
+
+        decided = [np.empty((0, self._num_speakers))]
+        for log_emission in log_emissions:
+            if self._scores is None:
+                self._scores = log_emission
+                continue
+            candidates = self._scores[:, :, np.newaxis] + self._log_transitions  # (speakers, from state, to state)
+            self._back_pointers.append(candidates.argmax(axis=1))
+            self._scores = candidates.max(axis=1) + log_emission
+            self._scores -= self._scores.max(axis=1, keepdims=True)  # Keeps the scores from drifting
+
+            # Checked after every chunk rather than every block, so the forced decisions don't depend on the blocks
+            if len(self._back_pointers) + 1 > self._max_delay:
+                num_forced = self._max_delay // 2
+                decided.append(self._trace_back(self._scores.argmax(axis=1)[:, np.newaxis])[:num_forced, :, 0])
+                self._back_pointers = self._back_pointers[num_forced:]
+
+        if self._scores is None:
+            return np.concatenate(decided, axis=0)
+
+        # Trace back from the best final state, or until now from both states: the chunks where both traces agree
+        # are on every path that can still turn out best, so they are decided
+        if final:
+            paths = self._trace_back(self._scores.argmax(axis=1)[:, np.newaxis])
+            num_decided = paths.shape[0]
+            self._scores = None
+            self._back_pointers = []
+        else:
+            paths = self._trace_back(np.tile(np.arange(2), (self._num_speakers, 1)))
+            num_decided = np.count_nonzero((paths[:, :, 0] == paths[:, :, 1]).all(axis=1))
+            self._back_pointers = self._back_pointers[num_decided:]
+        decided.append(paths[:num_decided, :, 0])
+        return np.concatenate(decided, axis=0).astype(float)
+
+    def _trace_back(self, states):
+        """Returns the (num_chunks, speakers, traces) states of every chunk not yet returned on the paths ending in
+        each of the given (speakers, traces) current states."""
+        paths = [states]
+        for back_pointer in reversed(self._back_pointers):
+            states = np.take_along_axis(back_pointer, states, axis=1)
+            paths.append(states)
+        return np.stack(paths[::-1])
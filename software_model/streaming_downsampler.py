@@ -0,0 +1,109 @@
+"""This module is an encapsulator for the StreamingDownsampler class."""
+import wave
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import decimate, resample_poly
+from software_model.constants import DOWNSAMPLE_FACTOR, RESAMPLER, STREAMING_BLOCK_SIZE, STREAMING_OVERLAP, \
+    INPUT_SCALING
+
+
+class StreamingDownsampler:
+    """Downsamples audio that arrives in blocks, giving the same output as downsampling the whole signal at once.
+
+    Each block is filtered together with STREAMING_OVERLAP samples of context either side, which is carried over from
+    the neighbouring blocks, so the filter transients at the block edges never reach the samples that are emitted.
+    Samples are emitted once enough of the following audio has arrived; flush() emits the rest at the end."""
+
+    def __init__(self, downsample_factor=DOWNSAMPLE_FACTOR, resampler=RESAMPLER, overlap=STREAMING_OVERLAP):
+        if resampler not in ('decimate', 'polyphase'):
+            raise ValueError("Resampler must be 'decimate' or 'polyphase'; Given: " + str(resampler))
+
+        self._factor = int(downsample_factor)
+        self._resampler = resampler
+        # Keep the block boundaries aligned with the downsampled sample grid
+        self._overlap = -(-overlap // self._factor) * self._factor
+        self._buffer = None
+        self._buffer_start = 0  # Input index of the first buffered sample
+        self._next_output = 0  # Input index of the next sample to be emitted
+
+    def process(self, block):
+        """Accepts the next block of audio and returns whatever downsampled audio it has finalized."""
+        block = np.asarray(block)
+        self._buffer = block if self._buffer is None else np.concatenate((self._buffer, block), axis=0)
+
+        buffer_end = self._buffer_start + self._buffer.shape[0]
+        output_end = (buffer_end - self._overlap) // self._factor * self._factor
+        if output_end <= self._next_output:
+            return self._empty_output()
+
+        output = self._filter_and_slice(output_end)
+        self._next_output = output_end
+
+        # Only the context for the next block needs to be kept
+        keep_from = max(self._next_output - self._overlap, self._buffer_start)
+        self._buffer = self._buffer[keep_from - self._buffer_start:]
+        self._buffer_start = keep_from
+        return output
+
+    def flush(self):
+        """Returns the remaining downsampled audio, treating the end of the buffered audio as the end of the signal."""
+        if self._buffer is None or self._next_output >= self._buffer_start + self._buffer.shape[0]:
+            return self._empty_output()
+
+        output = self._filter_and_slice(None)
+        self._next_output = self._buffer_start + self._buffer.shape[0]
+        return output
+
+    def _filter_and_slice(self, output_end):
+        segment_start = max(self._next_output - self._overlap, self._buffer_start)
+        segment = self._buffer[segment_start - self._buffer_start:]
+
+        if self._resampler == 'decimate':
+            filtered = decimate(segment, self._factor, axis=0)
+        else:
+            filtered = resample_poly(segment, 1, self._factor, axis=0)
+
+        first = (self._next_output - segment_start) // self._factor
+        if output_end is None:
+            return filtered[first:]
+        return filtered[first:(output_end - segment_start) // self._factor]
+
+    def _empty_output(self):
+        shape = (0,) if self._buffer is None else (0,) + self._buffer.shape[1:]
+        return np.empty(shape, dtype=np.float64)
+
+
+def downsample_file_streaming(infile, outfile, downsample_factor=DOWNSAMPLE_FACTOR, resampler=RESAMPLER,
+                              block_size=STREAMING_BLOCK_SIZE, input_scaling=INPUT_SCALING):
+    """Downsample an audio file block by block, so memory use does not depend on the length of the file.
+
+    With 'peak' input scaling the file is downsampled twice: once to find the peak used to normalize to the int16
+    range, and again to write."""
+    rate, aud = wavfile.read(infile, mmap=True)
+
+    int16_info = np.iinfo(np.dtype('int16'))
+    scale = None
+    if input_scaling == 'peak':
+        peak = 0
+        for daud in _downsample_blocks(aud, downsample_factor, resampler, block_size):
+            if daud.shape[0] > 0:
+                peak = max(peak, np.max(np.abs(daud)))
+        scale = int16_info.max / peak
+
+    with wave.open(outfile, 'wb') as wav_being_written:
+        wav_being_written.setnchannels(1 if aud.ndim == 1 else aud.shape[1])
+        wav_being_written.setsampwidth(2)
+        wav_being_written.setframerate(rate // downsample_factor)
+        for daud in _downsample_blocks(aud, downsample_factor, resampler, block_size):
+            if scale is None:
+                np.clip(daud, int16_info.min, int16_info.max, out=daud)
+            else:
+                daud *= scale
+            wav_being_written.writeframes(daud.astype('<i2').tobytes())
+
+
+def _downsample_blocks(aud, downsample_factor, resampler, block_size):
+    downsampler = StreamingDownsampler(downsample_factor, resampler)
+    for start in range(0, aud.shape[0], block_size):
+        yield downsampler.process(aud[start:start + block_size])
+    yield downsampler.flush()
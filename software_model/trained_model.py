@@ -0,0 +1,101 @@
+"""This module is an encapsulator for the TrainedModel class, a classifier saved with the settings it was trained with.
+
+A model is a directory holding model.json, which records the format version, the feature view and feature settings,
+and the pipeline constants the features were made with, and classifier.pkl, the pickled classifier and scaler."""
+import json
+import os
+import pickle
+import numpy as np
+from software_model.feature_extractor import FeatureExtractor
+from software_model.constants import NUM_CHANNELS, ORIGINAL_SAMP_RATE_S, DOWNSAMPLE_FACTOR, RESAMPLER, CHUNK_SIZE_MS, \
+    HOP_SIZE_MS, INPUT_SCALING
+
+MODEL_FORMAT_VERSION = 1
+MODEL_FILE = 'model.json'
+CLASSIFIER_FILE = 'classifier.pkl'
+
+# The speaker statuses ([speaker 1, speaker 2]) of each class label, as label_y_value assigns them
+LABELS = np.array(['A', 'B', 'C', 'D'])
+LABEL_STATUSES = np.array([[0, 0], [0, 1], [1, 0], [1, 1]])
+
+
+class IncompatibleModelError(Exception):
+    """Raised when a saved model was made in another format or with other pipeline constants."""
+
+
+def get_pipeline_constants():
+    """Returns the constants which determine the chunks a model's features are made from, including their scaling."""
+    return {'NUM_CHANNELS': NUM_CHANNELS, 'ORIGINAL_SAMP_RATE_S': ORIGINAL_SAMP_RATE_S,
+            'DOWNSAMPLE_FACTOR': DOWNSAMPLE_FACTOR, 'RESAMPLER': RESAMPLER, 'CHUNK_SIZE_MS': CHUNK_SIZE_MS,
+            'HOP_SIZE_MS': HOP_SIZE_MS, 'INPUT_SCALING': INPUT_SCALING}
+
+
+class TrainedModel:
+    """A fitted classifier of the 'A'-'D' labels of one feature view, which annotates whole ChunkBatches at once."""
+
+    def __init__(self, classifier, view, feature_settings, scaler=None, metadata=None):
+        if view not in ('raw0', 'raw1', 'fft0', 'fft1'):
+            raise ValueError("View must be one of 'raw0', 'raw1', 'fft0' or 'fft1'; Given: " + str(view))
+
+        self._classifier = classifier
+        self._view = view
+        self._feature_settings = dict(feature_settings)
+        self._feature_extractor = FeatureExtractor(**self._feature_settings)
+        self._scaler = scaler
+        self.metadata = metadata or {}
+
+    def save(self, directory):
+        """Writes the model to the given directory, creating it if need be."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, CLASSIFIER_FILE), 'wb') as classifier_file:
+            pickle.dump({'classifier': self._classifier, 'scaler': self._scaler}, classifier_file)
+
+        description = {'version': MODEL_FORMAT_VERSION, 'view': self._view, 'features': self._feature_settings,
+                       'constants': get_pipeline_constants(), 'metadata': self.metadata}
+        with open(os.path.join(directory, MODEL_FILE), 'w') as model_file:
+            json.dump(description, model_file, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        """Reads a model saved by save, raising IncompatibleModelError unless it suits the current constants."""
+        with open(os.path.join(directory, MODEL_FILE), 'r') as model_file:
+            description = json.load(model_file)
+
+        if description.get('version') != MODEL_FORMAT_VERSION:
+            raise IncompatibleModelError("{} is a version {} model; only version {} can be read".format(
+                directory, description.get('version'), MODEL_FORMAT_VERSION))
+
+        constants = get_pipeline_constants()
+        mismatched = sorted(name for name in constants if description['constants'].get(name) != constants[name])
+        if mismatched:
+            raise IncompatibleModelError("{} was trained with other constants: {}".format(directory, ', '.join(
+                "{}={} (now {})".format(name, description['constants'].get(name), constants[name])
+                for name in mismatched)))
+
+        with open(os.path.join(directory, CLASSIFIER_FILE), 'rb') as classifier_file:
+            fitted = pickle.load(classifier_file)
+        return cls(fitted['classifier'], description['view'], description['features'], fitted['scaler'],
+                   description.get('metadata'))
+
+    def get_view(self):
+        return self._view
+
+    def get_feature_extractor(self):
+        return self._feature_extractor
+
+    def predict(self, features):
+        """Returns a (num_chunks, 2) array of the speaker statuses predicted from a (num_chunks, num_features) matrix."""
+        if features.shape[0] == 0:
+            return np.empty((0, 2), dtype=np.int64)
+        if self._scaler is not None:
+            features = self._scaler.transform(features)
+        return LABEL_STATUSES[np.searchsorted(LABELS, self._classifier.predict(features))]
+
+    def evaluate_chunks(self, chunk_batch):
+        """Returns the speaker statuses of every chunk in a ChunkBatch, predicted with one call to the classifier."""
+        channel = int(self._view[-1])
+        if self._view.startswith('raw'):
+            features = chunk_batch.get_channel(channel)
+        else:
+            features = chunk_batch.get_features(channel, self._feature_extractor)
+        return self.predict(features)
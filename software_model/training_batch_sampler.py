@@ -0,0 +1,76 @@
+"""This module is an encapsulator for the TrainingBatchSampler class."""
+import queue
+import threading
+import numpy as np
+from software_model.constants import TRAINING_PREFETCH_BATCHES
+
+
+class TrainingBatchSampler:
+    """Samples batches of annotated chunks in shuffled epochs, without replacement.
+
+    Every chunk of every file has a row in the feature and label arrays, so a batch is a single fancy index into each
+    of them. Batches are prepared on a background thread and held in a bounded queue, keeping the next few ready
+    before the training loop asks for them."""
+
+    def __init__(self, features, labels, batch_size, file_offsets=None, prefetch=TRAINING_PREFETCH_BATCHES,
+                 drop_last=False, seed=None):
+        self._features = features
+        self._labels = labels
+        self._batch_size = batch_size
+        self._prefetch = prefetch
+        self._drop_last = drop_last
+        self._random = np.random.default_rng(seed)
+        self.num_chunks = labels.shape[0]
+        # The first row of each file, letting a row be mapped back to its (file, chunk)
+        self._file_offsets = np.array([0] if file_offsets is None else file_offsets)
+
+    def __len__(self):
+        """The number of batches in an epoch."""
+        if self._drop_last:
+            return self.num_chunks // self._batch_size
+        return -(-self.num_chunks // self._batch_size)
+
+    def __iter__(self):
+        return self.get_epoch()
+
+    def get_file_and_chunk(self, rows):
+        """Returns the file indices and chunk indices of the given global rows."""
+        file_indices = np.searchsorted(self._file_offsets, rows, side='right') - 1
+        return file_indices, rows - self._file_offsets[file_indices]
+
+    def get_epoch(self):
+        """Yields (features, labels) batches covering every chunk once, in a new random order."""
+        order = self._random.permutation(self.num_chunks)
+        batches = queue.Queue(maxsize=self._prefetch)
+        stop = threading.Event()
+
+        worker = threading.Thread(target=self._fill, args=(order, batches, stop), daemon=True)
+        worker.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            # Let the worker finish if the epoch was abandoned part way through
+            stop.set()
+            while worker.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    worker.join(0.01)
+
+    def _fill(self, order, batches, stop):
+        try:
+            for batch_index in range(len(self)):
+                if stop.is_set():
+                    return
+                # Sorted rows keep the reads sequential when the arrays are memory mapped
+                rows = np.sort(order[batch_index * self._batch_size:(batch_index + 1) * self._batch_size])
+                batches.put(({view: matrix[rows] for view, matrix in self._features.items()}, self._labels[rows]))
+            batches.put(None)
+        except BaseException as error:
+            batches.put(error)
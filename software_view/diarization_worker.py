@@ -0,0 +1,39 @@
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+from software_model.diarizer import Diarizer, DiarizationCancelled
+
+
+class DiarizationSignals(QObject):
+    # Qt delivers these on the thread that owns the receiving widget, so workers never touch widgets directly
+    progress = pyqtSignal(str, int, int)  # File, chunks done, chunks in file
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+    cancelled = pyqtSignal(str)
+
+
+class DiarizationWorker(QRunnable):
+    """Annotates one .wav file on a QThreadPool thread, reporting through a DiarizationSignals object."""
+
+    def __init__(self, wav_file, output_directory, network_location, signals, cancel):
+        QRunnable.__init__(self)
+        self._wav_file = wav_file
+        self._output_directory = output_directory
+        self._network_location = network_location
+        self._signals = signals
+        self._cancel = cancel
+
+    def run(self):
+        if self._cancel.is_set():
+            self._signals.cancelled.emit(self._wav_file)
+            return
+
+        try:
+            diarizer = Diarizer(self._network_location)
+            diarizer.annotate_wav_file(self._wav_file, self._output_directory, self._report_progress, self._cancel)
+            self._signals.finished.emit(self._wav_file)
+        except DiarizationCancelled:
+            self._signals.cancelled.emit(self._wav_file)
+        except Exception as error:
+            self._signals.failed.emit(self._wav_file, str(error))
+
+    def _report_progress(self, num_chunks_done, num_chunks):
+        self._signals.progress.emit(self._wav_file, num_chunks_done, num_chunks)
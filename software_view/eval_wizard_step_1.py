@@ -65,8 +65,8 @@ class EvalWizardStep1Window(QMainWindow):
             wav_files = [str(self._filenames_list.item(i).text()) for i in range(self._filenames_list.count())]
             output_directory = self._output_directory.text()
             network_location = self._network_location.text()
-            # Substring network location to give true value needed
-            network_location = network_location[0:network_location.rindex(".")]
+            # A model is the directory holding the selected model.json
+            network_location = str(Path(network_location).parent)
             self._step2 = EvalWizardStep2Window(wav_files, output_directory, network_location)
             self._step2.show()
             self.close()
@@ -93,7 +93,7 @@ class EvalWizardStep1Window(QMainWindow):
 
     def _select_network(self):
         try:
-            data = QFileDialog.getOpenFileName(None, '', str(Path.home()), '*.ckpt.meta', '')
+            data = QFileDialog.getOpenFileName(None, '', str(Path.home()), 'Models (model.json)', '')
             self._network_location.setText(data[0])
         except:
             None
@@ -1,9 +1,12 @@
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QMainWindow, QLabel, QGridLayout, QWidget
-from PyQt5.QtCore import QSize
+from PyQt5.QtWidgets import QMainWindow, QLabel, QGridLayout, QWidget, QPushButton
+from PyQt5.QtCore import QSize, QThreadPool
 from PyQt5.Qt import QProgressBar
-import time
-from threading import Thread
+from pathlib import Path
+from threading import Event
+from software_view.diarization_worker import DiarizationSignals, DiarizationWorker
+
+PROGRESS_RESOLUTION = 1000
 
 
 class EvalWizardStep2Window(QMainWindow):
@@ -28,8 +31,8 @@ class EvalWizardStep2Window(QMainWindow):
         title.setAlignment(QtCore.Qt.AlignCenter)
 
         self._all_files_progress = QProgressBar(self)
-        self._all_files_progress.setMinimum(1)
-        self._all_files_progress.setMaximum(len(wav_files))
+        self._all_files_progress.setMinimum(0)
+        self._all_files_progress.setMaximum(PROGRESS_RESOLUTION)
 
         self._file_name_lbl = QLabel("File: ", self)
         self._file_name_lbl.setAlignment(QtCore.Qt.AlignCenter)
@@ -37,6 +40,9 @@ class EvalWizardStep2Window(QMainWindow):
         self._file_progress_lbl = QLabel("0%", self)
         self._file_progress_lbl.setAlignment(QtCore.Qt.AlignCenter)
 
+        self._cancel_btn = QPushButton("Cancel", self)
+        self._cancel_btn.clicked.connect(self._cancel_actions)
+
         gridLayout.setRowStretch(0, 0)
         gridLayout.addWidget(title, 1, 0)
         gridLayout.setRowStretch(2, 0)
@@ -44,21 +50,66 @@ class EvalWizardStep2Window(QMainWindow):
         gridLayout.addWidget(self._file_name_lbl, 4, 0)
         gridLayout.addWidget(self._file_progress_lbl, 5, 0)
         gridLayout.setRowStretch(49, 0)
-        gridLayout.setRowStretch(50, 0)
+        gridLayout.addWidget(self._cancel_btn, 50, 0)
+
+        self._file_fractions = {wav_file: 0 for wav_file in wav_files}
+        self._num_files_done = 0
+        self._failures = []
 
-        thread = Thread(target=self.exe_controler, args=())
-        thread.start()
+        self._cancel = Event()
+        self._signals = DiarizationSignals()
+        self._signals.progress.connect(self._on_progress)
+        self._signals.finished.connect(self._on_file_done)
+        self._signals.cancelled.connect(self._on_file_done)
+        self._signals.failed.connect(self._on_file_failed)
+
+        # The application's pool outlives this window, so closing it never waits on a worker
+        self._pool = QThreadPool.globalInstance()
+        self.exe_controler()
 
     def exe_controler(self):
-        # net = network.open(self.network_location)
-        i = 0
-        for file_name in self.wav_files:
-            self._file_name_lbl.setText("File: " + file_name)
-            # net.annotate_wav_file(file_name, self.output_directory)
-
-            time.sleep(0.1)  # Delete This Line Shortly
-            self._all_files_progress.setValue(i)
-            self._file_progress_lbl.setText(str(i * 100 / len(self.wav_files)) + "%")
-            i += 1
-        self._all_files_progress.setValue(len(self.wav_files))
-        self._file_progress_lbl.setText("100%; Your files have now been annotated. Please close this window.")
+        for wav_file in self.wav_files:
+            self._pool.start(DiarizationWorker(wav_file, self.output_directory, self.network_location,
+                                               self._signals, self._cancel))
+
+    def closeEvent(self, event):
+        # Workers still reading or downsampling a file notice the cancellation once that is done, in the background
+        self._cancel_actions()
+        QMainWindow.closeEvent(self, event)
+
+    def _cancel_actions(self):
+        # Running workers stop at their next progress check, queued ones as soon as they start
+        self._cancel.set()
+        self._cancel_btn.setDisabled(True)
+        self._file_progress_lbl.setText("Cancelling...")
+
+    def _on_progress(self, wav_file, num_chunks_done, num_chunks):
+        self._file_fractions[wav_file] = num_chunks_done / num_chunks
+        self._file_name_lbl.setText("File: " + Path(wav_file).name)
+        self._update_progress()
+
+    def _on_file_failed(self, wav_file, error):
+        self._failures.append(Path(wav_file).name + ": " + error)
+        self._on_file_done(wav_file)
+
+    def _on_file_done(self, wav_file):
+        self._file_fractions[wav_file] = 1
+        self._num_files_done += 1
+        self._update_progress()
+
+        if self._num_files_done < len(self.wav_files):
+            return
+
+        self._cancel_btn.setDisabled(True)
+        if self._cancel.is_set():
+            self._file_progress_lbl.setText("Cancelled. Please close this window.")
+        elif self._failures:
+            self._file_progress_lbl.setText("Some files could not be annotated:\n" + "\n".join(self._failures))
+        else:
+            self._file_progress_lbl.setText("100%; Your files have now been annotated. Please close this window.")
+
+    def _update_progress(self):
+        fraction = sum(self._file_fractions.values()) / len(self.wav_files)
+        self._all_files_progress.setValue(int(fraction * PROGRESS_RESOLUTION))
+        if not self._cancel.is_set():
+            self._file_progress_lbl.setText("{:.0f}%".format(fraction * 100))